@@ -0,0 +1,147 @@
+'''
+@file band_stats.py
+@author Scott L. Williams
+@package POLI
+@section LICENSE
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+@section DESCRIPTION
+Band value range and linear rescaling shared by norm, cnorm and display
+'''
+
+band_stats_copyright = 'band_stats.py Copyright (c) 2010-2022 Scott L. Williams, released under GNU GPL V3.0'
+
+# images are worked on in blocks of rows small enough to stay in
+# cache, so the minimum, maximum and nan count come from a single
+# read of the image and rescaling needs no image sized temporaries.
+
+import numpy as np
+
+BLOCK_ELEMENTS = 1 << 16       # values per block
+
+# rows of an image per block
+def block_rows( image ):
+    per_row = max( 1, image[:1].size )
+    return max( 1, BLOCK_ELEMENTS//per_row )
+
+# value range of a band, or of several bands scaled together.
+# nan values are ignored; infinities count.
+class band_stats():
+    def __init__( self ):
+        self.min = np.inf
+        self.max = -np.inf
+        self.nnan = 0            # number of nan values
+        self.count = 0           # number of values, nan included
+
+    # no values other than nan
+    def empty( self ):
+        return self.count == self.nnan
+
+    def has_inf( self ):
+        return np.isinf( self.min ) or np.isinf( self.max )
+
+    # fold in the values of another band_stats, eg. of another file
+    def merge( self, other ):
+        self.min = min( self.min, other.min )
+        self.max = max( self.max, other.max )
+        self.nnan += other.nnan
+        self.count += other.count
+        return self
+
+# measure an image of any shape in one blocked pass
+def measure( image, stats=None ):
+    if stats == None:
+        stats = band_stats()
+
+    floating = np.issubdtype( image.dtype, np.floating )
+    step = block_rows( image )
+
+    for top in range( 0, max( len( image ), 1 ), step ):
+        block = image[top:top+step]
+        if block.size == 0:
+            continue
+
+        stats.count += block.size
+        if floating:
+
+            # fmin and fmax skip nan without a mask
+            low = np.fmin.reduce( block, axis=None )
+            high = np.fmax.reduce( block, axis=None )
+            stats.nnan += int( np.count_nonzero( np.isnan( block ) ) )
+            if np.isnan( low ):
+                continue         # all nan
+        else:
+            low = np.min( block )
+            high = np.max( block )
+
+        stats.min = min( stats.min, float( low ) )
+        stats.max = max( stats.max, float( high ) )
+
+    return stats
+
+# scale and offset mapping the measured range onto floor to ceiling.
+# constant, empty and infinite ranges give a surface plane
+def coefficients( stats, floor, ceiling ):
+    if stats.empty() or stats.max == stats.min or stats.has_inf():
+        return 0.0, 0.0
+
+    scale = (ceiling-floor)/float( stats.max-stats.min )
+    return scale, floor-scale*stats.min
+
+# out = (image - origin)*scale + offset, optionally clipped to low,
+# high. each block is worked in the precision of the source (float64
+# for float64 and wide integer images, float32 otherwise) and only
+# cast to the type of out at the end; outputs of that type are
+# written in place
+def scale_offset( image, scale, offset, out, low=None, high=None, origin=None ):
+    work = np.result_type( image.dtype, np.float32 )
+    direct = out.dtype == work
+    step = block_rows( image )
+
+    for top in range( 0, len( image ), step ):
+        block = image[top:top+step]
+
+        if direct:
+            target = out[top:top+step]
+        else:
+            target = np.empty( block.shape, dtype=work )
+
+        if origin != None:
+            np.subtract( block, origin, out=target, casting='unsafe' )
+            target *= scale
+        else:
+            np.multiply( block, scale, out=target, casting='unsafe' )
+        target += offset
+        if low != None:
+            np.clip( target, low, high, out=target )
+
+        if not direct:
+            out[top:top+step] = target
+
+    return out
+
+# map the measured range of image onto floor to ceiling in out.
+# works from the minimum so a small range far from zero keeps its
+# detail; returns the equivalent scale and offset
+def stretch( image, stats, floor, ceiling, out ):
+    scale, c = coefficients( stats, floor, ceiling )
+
+    if scale == 0.0:
+        scale_offset( image, scale, c, out )
+    else:
+        scale_offset( image, scale, floor, out, origin=stats.min )
+
+    return scale, c
@@ -31,6 +31,7 @@ import pickle
 import numpy as np
 from PIL import Image	
 
+from band_stats import measure, stretch
 from threads import apply_thread
 from threads import monitor_thread
 from threads import EVT_PROCESS_DONE_EVENT
@@ -114,7 +115,16 @@ class op_panel( wx.Panel ):
             print( e, file=sys.stderr )
             return False
 
-        self.params = pickle.loads( array )
+        params = pickle.loads( array )
+
+        # parameter files written before a parameter was added
+        # keep working; take the missing values from the defaults
+        if self.params != None:
+            for key, value in vars( self.params ).items():
+                if not hasattr( params, key ):
+                    setattr( params, key, value )
+
+        self.params = params
         return True
 
     # pickle and store parameter values
@@ -627,7 +637,7 @@ class op_panel( wx.Panel ):
         if self.sink.dtype == np.uint8:
             image[:,:,0] = self.sink[:,:,index]  # use view directly
         else:
-            image[:,:,0] = self.recast_band( self.sink[:,:,index] )
+            self.recast_band( self.sink[:,:,index], image[:,:,0] )
 
         self.hist,edges = np.histogram( image, 256, (0.0,255.0) ) 
         self.hist.shape = 1, len(self.hist) # reshape to 1-band, 255
@@ -640,39 +650,23 @@ class op_panel( wx.Panel ):
         # start new registry index if areal_index = None
         self.benchtop.set_images( self, self.areal_index )  
 
-    # convert single-banded image to byte datatype for display
-    def recast_band( self, image ):
-        min = np.nanmin(image)         # get values to scale by
-        max = np.nanmax(image)         # ignoring nan
-
-        if max == min :                # check for constant values
-            scale = 0.0 	       # make image a surface plane
-            c = 0.0
-        else:
-            # TODO: handle min=-inf,max=inf
-            if np.isinf( min ):
-                print( min, file=sys.stderr )
-
-            if np.isinf( max ):
-                print( max, file=sys.stderr )
+    # convert single-banded image to byte datatype for display,
+    # into out if given
+    def recast_band( self, image, out=None ):
+        stats = measure( image )       # values to scale by, ignoring nan
 
-            scale = 255.0/(max-min)    # plain stretch to 8-bit range
-            c = -scale*min
+        # TODO: handle min=-inf,max=inf; shown as a surface plane
+        if stats.has_inf():
+            print( stats.min, stats.max, file=sys.stderr )
 
         # supply our own resultant array of byte type
-        height,width = image.shape
-        b_image = np.empty( (height,width), dtype=np.uint8 )
-
-        '''
-        b_image = (image*scale).astype( np.uint8 )
-        b_image = (b_image + c).astype( np.uint8 )
-        '''
-
-        # FIXME: this returns float32 type but still works
-        b_image = image*scale
-        b_image = b_image + c
+        if out is None:
+            height,width = image.shape
+            out = np.empty( (height,width), dtype=np.uint8 )
 
-        return b_image
+        # plain stretch to 8-bit range
+        stretch( image, stats, 0.0, 255.0, out )
+        return out
 
     # end recast_band
 
@@ -704,9 +698,9 @@ class op_panel( wx.Panel ):
             sorted_image[:,:,1] = self.sink[:,:,g]
             sorted_image[:,:,2] = self.sink[:,:,b]
         else:
-            sorted_image[:,:,0] = self.recast_band( self.sink[:,:,r] )
-            sorted_image[:,:,1] = self.recast_band( self.sink[:,:,g] )
-            sorted_image[:,:,2] = self.recast_band( self.sink[:,:,b] )
+            self.recast_band( self.sink[:,:,r], sorted_image[:,:,0] )
+            self.recast_band( self.sink[:,:,g], sorted_image[:,:,1] )
+            self.recast_band( self.sink[:,:,b], sorted_image[:,:,2] )
             
         # make it a wx bmp
         self.display_image = self.render_bmp( sorted_image )
@@ -0,0 +1,136 @@
+'''
+@file pixel_store.py
+@author Scott L. Williams
+@package POLI
+@section LICENSE
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+@section DESCRIPTION
+Pixel training set spread over many memory mapped .npy images
+'''
+
+pixel_store_copyright = 'pixel_store.py Copyright (c) 2010-2022 Scott L. Williams, released under GNU GPL V3.0'
+
+# each file holds a Y,X,band image (or a T,Y,X,band cube from
+# wrf_source) saved with np.save. files are memory mapped and
+# viewed as one long stream of pixels; only the blocks being worked
+# on are read, so memory use depends on the block size and not on
+# the number of files.
+
+import sys
+import glob
+import numpy as np
+
+class pixel_store():
+    def __init__( self, arrays ):
+
+        # view each array as (npix,nbands); no copy for .npy memmaps
+        self.arrays = [ np.reshape( a, (-1, a.shape[-1]) ) for a in arrays ]
+        self.nbands = self.arrays[0].shape[1]
+
+        sizes = [ len( a ) for a in self.arrays ]
+        self.offsets = np.concatenate( ( [0], np.cumsum( sizes ) ) )
+
+    def __len__( self ):
+        return int( self.offsets[-1] )
+
+    # read pixels by index into memory
+    def gather( self, indices ):
+        indices = np.sort( indices )
+        pixels = np.empty( (len( indices ), self.nbands),
+                           dtype=self.arrays[0].dtype )
+
+        bounds = np.searchsorted( indices, self.offsets )
+        for i, array in enumerate( self.arrays ):
+            lo, hi = bounds[i], bounds[i+1]
+            if hi > lo:
+                pixels[lo:hi] = array[indices[lo:hi] - self.offsets[i]]
+
+        return pixels
+
+    # random sample of about n pixels, eg. for weight initialization
+    def sample( self, n, random_generator ):
+        if n >= len( self ):
+            return self.gather( np.arange( len( self ) ) )
+
+        indices = random_generator.randint( 0, len( self ), n )
+        return self.gather( np.unique( indices ) )
+
+    # read the store a block of at most chunk_size pixels at a time.
+    # with a random generator, each block is put together from 'mix'
+    # pieces at random places in the store and shuffled, so blocks
+    # are not dominated by one region of one image.
+    def blocks( self, chunk_size, random_generator=None, mix=16 ):
+        if random_generator != None:
+            piece = max( 1, chunk_size//mix )
+        else:
+            piece = chunk_size
+
+        spans = []
+        for i, array in enumerate( self.arrays ):
+            for start in range( 0, len( array ), piece ):
+                spans.append( (i, start, min( start+piece, len( array ) )) )
+
+        if random_generator == None:
+            for i, start, stop in spans:
+                yield np.array( self.arrays[i][start:stop] )
+            return
+
+        spans = [ spans[k] for k in random_generator.permutation( len( spans ) ) ]
+        for first in range( 0, len( spans ), mix ):
+            block = np.concatenate( [ self.arrays[i][start:stop]
+                                      for i, start, stop in spans[first:first+mix] ] )
+            yield block[random_generator.permutation( len( block ) )]
+
+# one random index from each of n equal strata of range( npix ),
+# so a sample spreads over every image and every region of them
+def stratified_indices( npix, n, random_generator ):
+    n = min( n, npix )
+    edges = ( np.arange( n+1, dtype=np.int64 )*npix )//n
+    widths = edges[1:] - edges[:-1]
+    return edges[:-1] + ( random_generator.random_sample( n )*widths ).astype( np.int64 )
+
+# memory map training files; names may be glob patterns.
+# returns None on failure
+def open_store( filenames ):
+    paths = []
+    for name in filenames:
+        found = sorted( glob.glob( name ) )
+        if len( found ) == 0:
+            print( 'pixel_store: no files match', name, file=sys.stderr )
+            return None
+        paths.extend( found )
+
+    arrays = []
+    for path in paths:
+        try:
+            array = np.load( path, mmap_mode='r' )
+        except ( IOError, ValueError ) as e:
+            print( 'pixel_store: cannot map', path, ':', e, file=sys.stderr )
+            return None
+
+        if array.ndim < 2:
+            print( 'pixel_store: no band axis in', path, file=sys.stderr )
+            return None
+
+        if len( arrays ) > 0 and array.shape[-1] != arrays[0].shape[-1]:
+            print( 'pixel_store: band count of', path, 'does not match',
+                   file=sys.stderr )
+            return None
+
+        arrays.append( array )
+
+    return pixel_store( arrays )
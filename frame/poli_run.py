@@ -0,0 +1,216 @@
+#! /usr/bin/env /usr/bin/python3
+
+'''
+@file poli_run.py
+@author Scott L. Williams
+@package POLI
+@brief run a chain of POLI operators in one process
+@section LICENSE
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+@section DESCRIPTION
+Batch runner for POLI. Chains operators in memory, each operator's sink
+becomes the next operator's source, without a pipe between stages.
+'''
+
+poli_run_copyright = 'poli_run.py Copyright (c) 2010-2022 Scott L. Williams ' + \
+                     'released under GNU GPL V3.0'
+
+# a pipeline spec lists one operator per line followed by the same
+# arguments the operator takes on the command line, eg.
+#
+#   # nightly ETo
+#   wrf_source  -f wrfout.nc -b TSK:6,EMISS:6,SWDOWN:6,GLW:6,GRDFLX:6,T2:6,PSFC:6,Q2:6,U10:6,V10:6
+#   prep_eto    -p prep_eto.params
+#   eto
+#   render      -f eto.png
+#
+# an operator is given either as a package path (eg. operators/norm_pack)
+# or as a name found in $POLI_HOME/operators. parameter files are the
+# ones the gui writes with 'write parameters as...'.
+#
+# this replaces: wrf_source.py ... | prep_eto.py ... | eto.py | render.py ...
+
+import os
+import sys
+import time
+import shlex
+import getopt
+
+import numpy as np
+
+from load_op_module import load_pack_module
+from poli_stream import read_stream, write_stream
+
+# find the operator package from a spec entry
+def find_package( entry ):
+    entry = os.path.expandvars( os.path.expanduser( entry ) )
+    entry = entry.rstrip( '/' )
+
+    if os.path.isdir( entry ):
+        return entry
+
+    # look for name in the poli operator directory
+    home = os.environ.get( 'POLI_HOME', '' )
+    path = os.path.join( home, 'operators', entry + '_pack' )
+    if os.path.isdir( path ):
+        return path
+
+    return None
+
+# read the pipeline spec; return list of (package path, argv)
+def read_spec( filename ):
+    stages = []
+
+    try:
+        sfile = open( filename, 'r' )
+    except IOError as e:
+        print( e, file=sys.stderr )
+        return None
+
+    for number, line in enumerate( sfile, 1 ):
+        items = shlex.split( line, comments=True )
+        if len( items ) == 0:
+            continue
+
+        package = find_package( items[0] )
+        if package == None:
+            print( 'poli_run: line', number, ': cannot find operator:',
+                   items[0], file=sys.stderr )
+            sfile.close()
+            return None
+
+        argv = [ os.path.expandvars( x ) for x in items[1:] ]
+        stages.append( (package, argv) )
+
+    sfile.close()
+    return stages
+
+# instantiate an operator and set its parameters as the
+# command line version would
+def load_operator( package, argv ):
+    module = load_pack_module( package )
+    if module == None:
+        return None
+
+    oper = module.instantiate()
+    oper.set_params( argv )
+    return oper
+
+# hand upstream output to the next operator; mirrors
+# op_panel.get_source and op_panel.set_areal_tags without a benchtop
+def link( upstream, oper ):
+    oper.source = upstream.sink
+    oper.attr = upstream.attr
+    oper.source_name = upstream.source_name
+
+    oper.band_tags = upstream.band_tags
+    oper.nav_data = upstream.nav_data
+    oper.nav_tags = upstream.nav_tags
+    oper.angles = upstream.angles
+    oper.overlay = upstream.overlay
+
+def run_pipeline( stages, read_input=False ):
+
+    opers = []
+    for package, argv in stages:
+        oper = load_operator( package, argv )
+        if oper == None:
+            print( 'poli_run: cannot load operator:', package, file=sys.stderr )
+            return None
+        opers.append( oper )
+
+    if read_input:
+        read_stream( opers[0] )             # first stage reads from stdin
+
+    upstream = None
+    for oper in opers:
+        if upstream != None:
+            link( upstream, oper )
+
+        print( 'poli_run: running', oper.name, end='',
+               file=sys.stderr, flush=True )
+        start = time.time()
+        oper.run()
+        duration = time.time() - start
+        print( '...done %.3f s' % duration, file=sys.stderr, flush=True )
+
+        # a stage with no output stops the chain, as in a broken pipe
+        if type( oper.sink ) is not np.ndarray:
+            print( 'poli_run:', oper.name, 'produced no output',
+                   file=sys.stderr )
+            return None
+
+        upstream = oper
+
+    return upstream
+
+############################################################
+# command line options
+############################################################
+
+def usage():
+    print( 'usage: poli_run.py', file=sys.stderr )
+    print( '       -h, --help', file=sys.stderr )
+    print( '       -p spec_file, --pipeline=spec_file', file=sys.stderr )
+    print( '       -i, --input     first operator reads stdin', file=sys.stderr )
+    print( '       -o filepath, --output=filepath', file=sys.stderr )
+    print( '       write last sink as poli stream, - for stdout',
+           file=sys.stderr )
+
+if __name__ == '__main__':
+    spec = None
+    output = None
+    read_input = False
+
+    try:
+        opts, args = getopt.getopt( sys.argv[1:], 'hp:io:',
+                                    ['help','pipeline=','input','output='] )
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt in ( '-h', '--help' ):
+            usage()
+            sys.exit(0)
+        elif opt in ( '-p', '--pipeline' ):
+            spec = arg
+        elif opt in ( '-i', '--input' ):
+            read_input = True
+        elif opt in ( '-o', '--output' ):
+            output = arg
+
+    if spec == None:
+        print( 'poli_run: no pipeline spec given', file=sys.stderr )
+        usage()
+        sys.exit(2)
+
+    stages = read_spec( spec )
+    if stages == None or len( stages ) == 0:
+        print( 'poli_run: no operators to run', file=sys.stderr )
+        sys.exit(2)
+
+    last = run_pipeline( stages, read_input )
+    if last == None:
+        sys.exit(1)
+
+    if output == '-':
+        write_stream( last, sys.stdout.buffer )
+    elif output != None:
+        ofile = open( output, 'wb' )
+        write_stream( last, ofile )
+        ofile.close()
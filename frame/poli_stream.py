@@ -0,0 +1,168 @@
+'''
+@file poli_stream.py
+@author Scott L. Williams
+@package POLI
+@section LICENSE
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+@section DESCRIPTION
+Framed wire format for passing operator data through a command line pipe
+'''
+
+poli_stream_copyright = 'poli_stream.py Copyright (c) 2010-2022 Scott L. Williams, released under GNU GPL V3.0'
+
+# a POLI stream is the magic string followed by frames. each frame is a
+# 4 byte tag, an 8 byte little endian payload length and the payload.
+#
+#   SHPE   json list, shape of the image buffer
+#   DTYP   numpy dtype string of the image buffer, eg. '<f4'
+#   TAGS   json list of band tags                          (optional)
+#   NSHP   json list, shape of the navigation buffer       (optional)
+#   NDTP   numpy dtype string of the navigation buffer     (optional)
+#   NTAG   json list of navigation tags                    (optional)
+#   NAVD   raw navigation buffer                           (optional)
+#   DATA   raw image buffer
+#   END    no payload, end of stream
+#
+# raw buffers are C ordered and are read straight from the pipe into
+# a preallocated array; no temporary file, no pickle, no extra copy.
+
+import io
+import sys
+import json
+import struct
+
+import numpy as np
+
+MAGIC = b'POLISTR1'
+FRAME_HEADER = struct.Struct( '<4sQ' )
+
+# write a single frame; payload is bytes or anything with a buffer
+def write_frame( stream, tag, payload ):
+    payload = memoryview( payload )
+    stream.write( FRAME_HEADER.pack( tag, payload.nbytes ) )
+    if payload.nbytes > 0:
+        stream.write( payload )
+
+def write_json( stream, tag, value ):
+    write_frame( stream, tag, json.dumps( value ).encode( 'utf-8' ) )
+
+# write array description and raw buffer frames
+def write_array( stream, shape_tag, dtype_tag, data_tag, array ):
+    array = np.ascontiguousarray( array )   # copies only if needed
+
+    write_json( stream, shape_tag, list( array.shape ) )
+    write_frame( stream, dtype_tag, array.dtype.str.encode( 'ascii' ) )
+    write_frame( stream, data_tag, byte_view( array ) )
+
+# flat byte view of a contiguous array, shares memory
+def byte_view( array ):
+    return memoryview( array.reshape( -1 ).view( np.uint8 ) )
+
+# read exactly nbytes into buffer; pipes can return short reads
+def read_into( stream, buffer ):
+    view = memoryview( buffer )
+    total = 0
+    while total < view.nbytes:
+        n = stream.readinto( view[total:] )
+        if not n:
+            raise EOFError( 'poli_stream: unexpected end of stream' )
+        total += n
+
+def read_bytes( stream, nbytes ):
+    buffer = bytearray( nbytes )
+    read_into( stream, buffer )
+    return bytes( buffer )
+
+# send operator output downstream
+def write_stream( oper, stream=None ):
+    if stream == None:
+        stream = sys.stdout.buffer
+
+    stream.write( MAGIC )
+
+    if oper.band_tags != None:
+        write_json( stream, b'TAGS', list( oper.band_tags ) )
+
+    if type( oper.nav_data ) is np.ndarray:
+        if oper.nav_tags != None:
+            write_json( stream, b'NTAG', list( oper.nav_tags ) )
+        write_array( stream, b'NSHP', b'NDTP', b'NAVD', oper.nav_data )
+
+    write_array( stream, b'SHPE', b'DTYP', b'DATA', oper.sink )
+    write_frame( stream, b'END ', b'' )
+    stream.flush()
+
+# read upstream output into the operator's source buffer
+def read_stream( oper, stream=None ):
+    if stream == None:
+        stream = sys.stdin.buffer
+
+    head = read_bytes( stream, len( MAGIC ) )
+    if head != MAGIC:
+
+        # an older operator or a numpy file piped in; BytesIO lets
+        # numpy 'seek' without going through a temporary file
+        data = io.BytesIO( head + stream.read() )
+        oper.source = np.load( data, allow_pickle=True, fix_imports=False )
+        return
+
+    shape = None
+    dtype = None
+    nshape = None
+    ndtype = None
+
+    while True:
+        tag, length = FRAME_HEADER.unpack( read_bytes( stream,
+                                                       FRAME_HEADER.size ) )
+        if tag == b'END ':
+            break
+
+        if tag == b'DATA':
+            oper.source = read_array( stream, shape, dtype, length )
+        elif tag == b'NAVD':
+            oper.nav_data = read_array( stream, nshape, ndtype, length )
+        else:
+            payload = read_bytes( stream, length )
+
+            if tag == b'SHPE':
+                shape = tuple( json.loads( payload ) )
+            elif tag == b'DTYP':
+                dtype = np.dtype( payload.decode( 'ascii' ) )
+            elif tag == b'TAGS':
+                oper.band_tags = json.loads( payload )
+            elif tag == b'NSHP':
+                nshape = tuple( json.loads( payload ) )
+            elif tag == b'NDTP':
+                ndtype = np.dtype( payload.decode( 'ascii' ) )
+            elif tag == b'NTAG':
+                oper.nav_tags = json.loads( payload )
+            else:
+                # unknown frames are skipped for forward compatibility
+                print( 'poli_stream: skipping unknown frame', tag,
+                       file=sys.stderr )
+
+# allocate the described array and fill it directly from the stream
+def read_array( stream, shape, dtype, length ):
+    if shape is None or dtype is None:   # dtype == None is True for float64
+        raise ValueError( 'poli_stream: buffer frame without description' )
+
+    array = np.empty( shape, dtype=dtype )
+    if array.nbytes != length:
+        raise ValueError( 'poli_stream: buffer size does not match description' )
+
+    read_into( stream, byte_view( array ) )
+    return array
@@ -0,0 +1,325 @@
+'''
+@file som_engine.py
+@author Scott L. Williams
+@package POLI
+@section LICENSE
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+@section DESCRIPTION
+Nearest neuron (best matching unit) search shared by the SOM operators
+'''
+
+som_engine_copyright = 'som_engine.py Copyright (c) 2010-2022 Scott L. Williams, released under GNU GPL V3.0'
+
+# pixels are matched against all neurons at once, a block of pixels
+# at a time, so that the distance scratch buffer stays bounded no
+# matter how large the image or the map is. large maps of few bands
+# are searched through a kd-tree over the neurons instead.
+#
+# euclidean and cosine distances come from a matrix product, worked
+# in float64; euclidean first moves pixels and neurons to the neuron
+# mean, so values far from zero (pressures, kelvins) do not cancel.
+# chebyshev is minisom's signed max( x - w ), not max( |x - w| ), so
+# labels match the winners the map was trained with.
+
+import os
+import sys
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:            # brute force only
+    cKDTree = None
+
+SCRATCH_BYTES = 64*1024*1024   # memory allowed for one block of distances
+
+# a kd-tree pays off from about this many neurons, and only in
+# low dimensions; above INDEX_MAX_BANDS it is slower than brute force
+INDEX_MIN_NEURONS = 256
+INDEX_MAX_BANDS = 8
+
+# minkowski p of each metric for the kd-tree. cosine is searched as
+# euclidean over unit vectors, where |x-w|^2 = 2(1-cos). minisom's
+# signed chebyshev is no minkowski distance and is not indexed
+INDEX_P = { 'euclidean' : 2, 'cosine' : 2, 'manhattan' : 1 }
+
+# distance metrics, same names as minisom activation_distance
+METRICS = ( 'euclidean', 'cosine', 'manhattan', 'chebyshev' )
+
+# number of pixels per block for a given map size
+def block_pixels( nneurons, nbands, metric='euclidean' ):
+
+    # manhattan and chebyshev need a full (pixel,neuron,band)
+    # float32 difference array; the others a float64 product
+    if metric in ( 'manhattan', 'chebyshev' ):
+        nbytes = 4*nneurons*max( nbands, 1 )
+    else:
+        nbytes = 8*nneurons*2
+
+    return max( 1, SCRATCH_BYTES//nbytes )
+
+# distances from a block of pixels (P,B) to all neurons (N,B) -> (P,N)
+# euclidean distances are returned squared; the ordering is the same.
+# for euclidean, pixels and neurons are float64 and already moved to
+# the neuron mean, and nsquared gives the squared neuron norms
+def block_distances( pixels, neurons, metric='euclidean', nsquared=None ):
+
+    if metric == 'euclidean':
+
+        # ||x||^2 - 2x.w + ||w||^2, the product goes through BLAS
+        if nsquared is None:
+            nsquared = np.einsum( 'ij,ij->i', neurons, neurons )
+
+        dist = pixels @ neurons.T
+        dist *= -2.0
+        dist += np.einsum( 'ij,ij->i', pixels, pixels )[:,np.newaxis]
+        dist += nsquared[np.newaxis,:]
+        np.maximum( dist, 0.0, out=dist )       # guard against rounding
+        return dist
+
+    if metric == 'cosine':
+
+        # 1 - x.w/(|x||w|), as minisom does
+        nnorms = np.sqrt( np.einsum( 'ij,ij->i', neurons, neurons ) )
+        pnorms = np.sqrt( np.einsum( 'ij,ij->i', pixels, pixels ) )
+
+        dist = pixels @ neurons.T
+        dist /= pnorms[:,np.newaxis]*nnorms[np.newaxis,:] + 1e-8
+        np.subtract( 1.0, dist, out=dist )
+        return dist
+
+    diff = pixels[:,np.newaxis,:] - neurons[np.newaxis,:,:]
+
+    if metric == 'manhattan':
+        np.abs( diff, out=diff )
+        return np.sum( diff, axis=2 )
+
+    return np.max( diff, axis=2 )               # chebyshev, as minisom
+
+def unit_rows( vectors ):
+    norms = np.sqrt( np.einsum( 'ij,ij->i', vectors, vectors ) )
+    return vectors/( norms[:,np.newaxis] + 1e-8 )
+
+# kd-tree over a set of neurons, built once and queried for
+# many pixels
+class neuron_index():
+    def __init__( self, neurons, metric='euclidean' ):
+        self.metric = metric
+        self.p = INDEX_P[metric]
+        self.nneurons = len( neurons )
+        self.nworkers = 0            # query threads, 0 for all cpus
+
+        neurons = np.asarray( neurons, dtype=np.float64 )
+        if metric == 'cosine':
+            neurons = unit_rows( neurons )
+        self.tree = cKDTree( neurons )
+
+    # same results as nearest(), up to ties
+    def query( self, pixels, return_distance=False ):
+        pixels = np.asarray( pixels, dtype=np.float64 )
+        if self.metric == 'cosine':
+            pixels = unit_rows( pixels )
+
+        distance, labels = self.tree.query( pixels, p=self.p,
+                                            workers=self.nworkers or -1 )
+        labels = labels.astype( np.intp )
+
+        if not return_distance:
+            return labels
+
+        distance = distance.astype( np.float32 )
+        if self.metric == 'cosine':
+            distance = distance*distance/2
+        return labels, distance
+
+# a kd-tree for these neurons, or None where brute force is faster
+def build_index( neurons, metric='euclidean' ):
+    nneurons, nbands = np.shape( neurons )
+
+    if cKDTree == None or metric not in INDEX_P:
+        return None
+    if nneurons < INDEX_MIN_NEURONS or nbands > INDEX_MAX_BANDS:
+        return None
+
+    return neuron_index( neurons, metric )
+
+# neurons as block_distances wants them for a metric: float64 and
+# moved to their mean for euclidean, with that mean and their squared
+# norms; float64 for cosine; float32 for the difference metrics
+def work_neurons( neurons, metric ):
+    if metric == 'euclidean':
+        neurons = np.asarray( neurons, dtype=np.float64 )
+        center = neurons.mean( axis=0 )
+        neurons = neurons - center
+        return neurons, center, np.einsum( 'ij,ij->i', neurons, neurons )
+
+    if metric == 'cosine':
+        return np.asarray( neurons, dtype=np.float64 ), None, None
+
+    return np.asarray( neurons, dtype=np.float32 ), None, None
+
+# a block of pixels in the type of the working neurons, moved by
+# the same center
+def work_pixels( pixels, neurons, center ):
+    block = np.asarray( pixels, dtype=neurons.dtype )
+    if center is not None:
+        block = block - center
+    return block
+
+# best matching neuron for each pixel row of a (npix,nbands) array;
+# index a neuron_index built over the same neurons
+def nearest( neurons, pixels, metric='euclidean', return_distance=False,
+             index=None ):
+
+    if index != None:
+        return index.query( pixels, return_distance )
+
+    npix = pixels.shape[0]
+
+    if metric not in METRICS:
+        print( 'som_engine: unknown distance metric:', metric,
+               file=sys.stderr )
+        return None
+
+    neurons, center, nsquared = work_neurons( neurons, metric )
+
+    labels = np.empty( npix, dtype=np.intp )
+    if return_distance:
+        distance = np.empty( npix, dtype=np.float32 )
+
+    step = block_pixels( neurons.shape[0], neurons.shape[1], metric )
+    for start in range( 0, npix, step ):
+        stop = min( start+step, npix )
+        block = work_pixels( pixels[start:stop], neurons, center )
+
+        dist = block_distances( block, neurons, metric, nsquared )
+        labels[start:stop] = np.argmin( dist, axis=1 )
+
+        if return_distance:
+            distance[start:stop] = np.min( dist, axis=1 )
+
+    if return_distance:
+        if metric == 'euclidean':
+            np.sqrt( distance, out=distance )
+        return labels, distance
+
+    return labels
+
+# best and second best matching neurons for each pixel row
+def nearest_two( neurons, pixels, metric='euclidean' ):
+    npix = pixels.shape[0]
+    nneurons = len( neurons )
+
+    if metric not in METRICS:
+        print( 'som_engine: unknown distance metric:', metric,
+               file=sys.stderr )
+        return None
+
+    best = np.zeros( npix, dtype=np.intp )
+    second = np.zeros( npix, dtype=np.intp )
+    if nneurons < 2:
+        return best, second
+
+    neurons, center, nsquared = work_neurons( neurons, metric )
+
+    step = block_pixels( nneurons, neurons.shape[1], metric )
+    for start in range( 0, npix, step ):
+        stop = min( start+step, npix )
+        block = work_pixels( pixels[start:stop], neurons, center )
+
+        dist = block_distances( block, neurons, metric, nsquared )
+
+        # two smallest per row, in order
+        two = np.argpartition( dist, 1, axis=1 )[:,:2]
+        best[start:stop] = two[:,0]
+        second[start:stop] = two[:,1]
+
+    return best, second
+
+# apply func( start, stop ) to consecutive row ranges of npix pixels
+# in a thread pool. workers slice the caller's arrays, so views are
+# shared rather than copied; numpy releases the interpreter lock in
+# the distance products. results are in order.
+def map_chunks( func, npix, nworkers=0 ):
+
+    if nworkers <= 0:
+        nworkers = os.cpu_count() or 1
+
+    # a few chunks per worker to even out the load
+    chunk = max( 1, -(-npix//(4*nworkers)) )
+    bounds = [ (start, min( start+chunk, npix ))
+               for start in range( 0, npix, chunk ) ]
+
+    if nworkers == 1 or len( bounds ) < 2:
+        return [ func( start, stop ) for start, stop in bounds ]
+
+    with ThreadPoolExecutor( max_workers=nworkers ) as pool:
+        return list( pool.map( lambda b: func( b[0], b[1] ), bounds ) )
+
+# smallest data type of label images that holds every label
+def label_dtype( nneurons ):
+    if nneurons <= 256:
+        return np.uint8
+    if nneurons <= 65536:
+        return np.uint16
+    return np.uint32
+
+# arrange flat neuron labels as a (height,width,1) label image
+def label_image( labels, height, width, nneurons ):
+    labels = labels.reshape( (height,width,1) )
+    return labels.astype( label_dtype( nneurons ) )
+
+# label a (height,width,nbands) image with its nearest neurons,
+# processing the image in tiles of rows
+def classify( neurons, image, metric='euclidean', return_distance=False,
+              index=None ):
+    num_neurons, nnbands = np.shape( neurons )
+    height, width, nbands = image.shape
+
+    if nnbands != nbands:
+        print( 'som_engine: dimensions do not match',
+               nnbands, nbands, file=sys.stderr )
+        return None
+
+    classified = np.empty( (height,width,1), dtype=label_dtype( num_neurons ) )
+    if return_distance:
+        min_distance = np.empty( (height,width,1), dtype=np.float32 )
+
+    if metric not in METRICS:
+        print( 'som_engine: unknown distance metric:', metric,
+               file=sys.stderr )
+        return None
+
+    rows = max( 1, block_pixels( num_neurons, nbands, metric )//max( width, 1 ) )
+    for top in range( 0, height, rows ):
+        bottom = min( top+rows, height )
+        tile = image[top:bottom].reshape( ((bottom-top)*width, nbands) )
+
+        result = nearest( neurons, tile, metric, return_distance, index )
+        if return_distance:
+            labels, distance = result
+            min_distance[top:bottom,:,0] = distance.reshape( (bottom-top,width) )
+        else:
+            labels = result
+
+        classified[top:bottom,:,0] = labels.reshape( (bottom-top,width) )
+
+    if return_distance:
+        return classified, min_distance
+
+    return classified
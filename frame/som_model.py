@@ -0,0 +1,182 @@
+'''
+@file som_model.py
+@author Scott L. Williams
+@package POLI
+@section LICENSE
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+@section DESCRIPTION
+Binary SOM model file written by msom and read by somclass, somgroup and msom
+'''
+
+som_model_copyright = 'som_model.py Copyright (c) 2010-2022 Scott L. Williams, released under GNU GPL V3.0'
+
+# a model is an uncompressed numpy .npz archive holding
+#
+#   weights    (nx,ny,nbands) neuron weights, full precision
+#   shape      map shape
+#   norms      euclidean norm of each neuron, in label order
+#   params     training parameters as a json string
+#   qe, te     quantization and topographic errors
+#   actmap     (nx,ny) pixel count per neuron, if computed
+#
+# neuron labels are the flattened (C order) weight indices, the same
+# labels the .labels text report lists. since the archive is stored
+# uncompressed the weights can be memory mapped straight from it.
+
+import sys
+import json
+import zipfile
+import numpy as np
+
+MODEL_SUFFIX = '.npz'
+
+class som_model():
+    def __init__( self ):
+        self.weights = None
+        self.shape = None
+        self.norms = None
+        self.params = {}
+        self.qe = np.nan
+        self.te = np.nan
+        self.actmap = None
+
+    # weights as (nneurons,nbands), indexed by label
+    def neurons( self ):
+        return self.weights.reshape( (-1, self.weights.shape[2]) )
+
+    # distance the map was trained with
+    def metric( self ):
+        return self.params.get( 'activation_distance', 'euclidean' )
+
+def is_model_file( filename ):
+    return filename != None and filename.endswith( MODEL_SUFFIX )
+
+def write_model( filename, weights, params=None, QE=np.nan, TE=np.nan,
+                 actmap=None ):
+    neurons = weights.reshape( (-1, weights.shape[2]) )
+
+    arrays = {}
+    arrays['weights'] = weights
+    arrays['shape'] = np.array( weights.shape[:2] )
+    arrays['norms'] = np.linalg.norm( neurons, axis=1 )
+    arrays['qe'] = np.array( QE, dtype=np.float64 )
+    arrays['te'] = np.array( TE, dtype=np.float64 )
+
+    if params != None:
+        arrays['params'] = np.array( json.dumps( vars( params ), default=str ) )
+
+    if isinstance( actmap, np.ndarray ):
+        arrays['actmap'] = actmap
+
+    np.savez( filename, **arrays )
+
+# memory map an array stored uncompressed in a .npz archive
+def mmap_member( filename, name ):
+    with zipfile.ZipFile( filename ) as zfile:
+        info = zfile.getinfo( name + '.npy' )
+
+    if info.compress_type != zipfile.ZIP_STORED:
+        return None
+
+    with open( filename, 'rb' ) as mfile:
+
+        # skip the local file header to the .npy content
+        mfile.seek( info.header_offset )
+        header = mfile.read( 30 )
+        namelen = int.from_bytes( header[26:28], 'little' )
+        extralen = int.from_bytes( header[28:30], 'little' )
+        mfile.seek( info.header_offset + 30 + namelen + extralen )
+
+        version = np.lib.format.read_magic( mfile )
+        if version == (1,0):
+            shape, fortran, dtype = np.lib.format.read_array_header_1_0( mfile )
+        else:
+            shape, fortran, dtype = np.lib.format.read_array_header_2_0( mfile )
+        offset = mfile.tell()
+
+    order = 'F' if fortran else 'C'
+    return np.memmap( filename, dtype=dtype, mode='r', offset=offset,
+                      shape=shape, order=order )
+
+# neurons of a .labels text report as a model with a (nneurons,1)
+# map; only the training distance is kept of the parameters. the
+# header lines are echoed to echo, a file, if given.
+# returns None on failure
+def read_report( filename, echo=None ):
+    model = som_model()
+    model.params['activation_distance'] = 'euclidean'    # minisom default
+
+    try:
+        with open( filename, 'r' ) as rfile:
+            found = False
+            for line in rfile:
+                if line.find( 'NEURONS' ) != -1:
+                    found = True
+                    break
+                if echo != None:
+                    print( line.strip(), file=echo )
+                if line.startswith( 'activation distance=' ):
+                    model.params['activation_distance'] = line.split( '=', 1 )[1].strip()
+
+            if not found:
+                print( 'som_model: no NEURONS flag in', filename, file=sys.stderr )
+                return None
+
+            nneurons, ndim = [ int( v ) for v in rfile.readline().split() ]
+            neurons = np.loadtxt( rfile, dtype=np.float32, max_rows=nneurons,
+                                  usecols=range( 1, ndim+1 ), ndmin=2 )
+
+    except ( IOError, ValueError ) as e:
+        print( 'som_model: cannot read report', filename, ':', e,
+               file=sys.stderr )
+        return None
+
+    model.weights = neurons.reshape( (nneurons, 1, ndim) )
+    model.shape = (nneurons, 1)
+    model.norms = np.linalg.norm( neurons, axis=1 )
+    return model
+
+# read a model; with mmap the weights are mapped, not read.
+# returns None on failure
+def read_model( filename, mmap=False ):
+    model = som_model()
+
+    try:
+        with np.load( filename ) as archive:
+            names = archive.files
+
+            if mmap:
+                model.weights = mmap_member( filename, 'weights' )
+            if model.weights is None:
+                model.weights = archive['weights']
+
+            model.shape = tuple( archive['shape'] )
+            model.norms = archive['norms']
+            model.qe = float( archive['qe'] )
+            model.te = float( archive['te'] )
+
+            if 'params' in names:
+                model.params = json.loads( str( archive['params'] ) )
+            if 'actmap' in names:
+                model.actmap = archive['actmap']
+
+    except ( IOError, KeyError, ValueError ) as e:
+        print( 'som_model: cannot read model', filename, ':', e,
+               file=sys.stderr )
+        return None
+
+    return model
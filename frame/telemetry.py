@@ -0,0 +1,121 @@
+'''
+@file telemetry.py
+@author Scott L. Williams
+@package POLI
+@section LICENSE
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+@section DESCRIPTION
+Rate limited progress lines and a JSON lines record of operator runs
+'''
+
+telemetry_copyright = 'telemetry.py Copyright (c) 2010-2022 Scott L. Williams, released under GNU GPL V3.0'
+
+# a telemetry file holds one json object per line, each with an
+# 'event' name, a timestamp and the event's measurements, so runs
+# on different machines and releases can be compared with a script.
+
+import sys
+import time
+import json
+import socket
+import datetime
+
+try:
+    import resource
+except ImportError:               # not on windows
+    resource = None
+
+# peak resident memory of this process in MB, None if unknown
+def peak_rss_mb():
+    if resource == None:
+        return None
+
+    # kilobytes on linux, bytes on mac
+    peak = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak/(1024*1024)
+    return peak/1024
+
+# json form of numpy scalars and anything else
+def plain( value ):
+    if hasattr( value, 'item' ):
+        return value.item()
+    return str( value )
+
+# progress of a long loop on stderr, at most one line per interval
+# seconds rather than one per step
+class progress_meter():
+    def __init__( self, total, interval=1.0, show=True ):
+        self.total = max( total, 1 )
+        self.interval = interval
+        self.show = show
+        self.start = time.perf_counter()
+        self.last = self.start
+
+    def update( self, done ):
+        if not self.show:
+            return
+
+        now = time.perf_counter()
+        if now - self.last < self.interval and done < self.total:
+            return
+        self.last = now
+
+        rate = done/max( now - self.start, 1e-9 )
+        print( '\r [ %d / %d ] %3d%% - %.0f samples/s' %
+               (done, self.total, 100*done//self.total, rate),
+               end='', file=sys.stderr, flush=True )
+
+    def finish( self ):
+        if self.show:
+            print( file=sys.stderr, flush=True )
+
+# append events to a json lines file; with no filename
+# records are dropped
+class telemetry():
+    def __init__( self, filename=None, name='' ):
+        self.tfile = None
+        self.name = name
+
+        if filename == None:
+            return
+
+        try:
+            self.tfile = open( filename, 'a' )
+        except IOError as e:
+            print( 'telemetry:', e, file=sys.stderr )
+
+    def active( self ):
+        return self.tfile != None
+
+    def record( self, event, **fields ):
+        if self.tfile == None:
+            return
+
+        entry = { 'event' : event,
+                  'operator' : self.name,
+                  'host' : socket.gethostname(),
+                  'timestamp' : datetime.datetime.now().isoformat() }
+        entry.update( fields )
+
+        self.tfile.write( json.dumps( entry, default=plain ) + '\n' )
+        self.tfile.flush()
+
+    def close( self ):
+        if self.tfile != None:
+            self.tfile.close()
+            self.tfile = None
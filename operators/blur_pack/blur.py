@@ -181,22 +181,12 @@ class blur( op_panel ):
 ####################################################################
 
 if __name__ == '__main__':
-    import os
-    import tempfile
+    from poli_stream import read_stream, write_stream
 
     oper = instantiate()
     oper.set_params(sys.argv[1:] )
 
-    # numpy needs to 'seek' in the file to load
-    # so read from stdin to temporary file first
-    temp_name = next(tempfile._get_candidate_names()) + '.tmp'
-    temp = open( temp_name, 'wb' )
-    temp.write( sys.stdin.buffer.read() )
-    temp.close()
-
-    # load the pickled data
-    oper.source = np.load( temp_name, allow_pickle=True,fix_imports=False)
-    os.remove( temp_name )
+    read_stream( oper )           # receive from upstream
  
     oper.run()                  
-    oper.sink.dump( sys.stdout.buffer )          # send downstream    
+    write_stream( oper )          # send downstream    
@@ -161,7 +161,9 @@ class cetin( op_panel ):
 ####################################################################
 
 if __name__ == '__main__':             
+    from poli_stream import write_stream
+
     oper = instantiate()                  # source point for pipe
     oper.set_params( sys.argv[1:] )
     oper.run()            
-    oper.sink.dump( sys.stdout.buffer )   # send downstream    
+    write_stream( oper )                  # send downstream    
@@ -30,11 +30,13 @@
 cnorm_copyright = 'norm.py Copyright (c) 2010-2022 Scott L. Williams, released under GNU GPL V3.0'
 
 import wx
+import os
 import sys
 import getopt
 import numpy as np
 
 from op_panel import op_panel
+from band_stats import scale_offset
 
 # return an instance of 'norm' class 
 # without having to know its name
@@ -44,6 +46,59 @@ def instantiate():
 def get_name(): 
     return 'cnorm'
 
+# coefficient files already read, by path:
+# ((mtime_ns, size), ntype, scale, offset)
+coefficient_cache = {}
+
+# normalization type and per band scale and offset vectors of a
+# coefficient file written by norm; reread only when the file
+# changes. returns None on failure
+def read_coefficients( filepath ):
+    try:
+        info = os.stat( filepath )
+    except OSError:
+        print( 'cnorm: could not open file: ', filepath, file=sys.stderr )
+        return None
+
+    # a rewrite within the mtime resolution usually changes the size
+    key = ( info.st_mtime_ns, info.st_size )
+    cached = coefficient_cache.get( filepath )
+    if cached != None and cached[0] == key:
+        return cached[1:]
+
+    try:
+        cfile = open( filepath, 'r' )
+        items = cfile.readline().split(',')
+        numbands = int( items[0].strip() )
+        ntype = int( items[1].strip() )
+
+        # band, scale, offset lines in any band order
+        table = np.loadtxt( cfile, delimiter=',', max_rows=numbands, ndmin=2 )
+        cfile.close()
+
+    except ( IOError, ValueError, IndexError ) as e:
+        print( 'cnorm: could not read file: ', filepath, e, file=sys.stderr )
+        return None
+
+    if len( table ) != numbands:
+        print( 'cnorm: missing band coefficients in', filepath, file=sys.stderr )
+        return None
+
+    # each band exactly once
+    bands = table[:,0].astype( int )
+    if not np.array_equal( np.sort( bands ), np.arange( numbands ) ):
+        print( 'cnorm: band indices in', filepath,
+               'are not 0 to', numbands-1, 'each once', file=sys.stderr )
+        return None
+
+    scale = np.empty( numbands, dtype=np.float32 )
+    offset = np.empty( numbands, dtype=np.float32 )
+    scale[bands] = table[:,1]
+    offset[bands] = table[:,2]
+
+    coefficient_cache[filepath] = ( key, ntype, scale, offset )
+    return ntype, scale, offset
+
 class FileDrop( wx.FileDropTarget ):         # clean up text after drop
     def __init__( self, window, op_panel ):
         wx.FileDropTarget.__init__(self)
@@ -68,6 +123,8 @@ class cnorm_parameters():             # hold arguments values here
         self.clip = True              # clip to bounds
                                       # TODO: implement checkbox in GUI
         self.filepath = 'ncoeffs.txt' 
+        self.inplace = False          # normalize a float32 source in its
+                                      # own buffer; the source is lost
 
 class cnorm( op_panel ):
     def __init__( self, name ):      # initialize op_panel but no graphics
@@ -77,51 +134,31 @@ class cnorm( op_panel ):
         self.op_id = 'cnorm version 0.0'
         self.params = cnorm_parameters()
 
-    # convert band range to floor to ceiling
-    def scale_band( self, image, scale, offset, ntype ):
-
-        norm = image*scale + offset
-
-        # clip to bounds
-        if self.params.clip:
-            norm = np.clip( norm, ntype, 1 )
-            
-        return norm
-
     def run( self ):                 # override superclass 
 
-        # read the number of bands and normalization type from file
-        try:
-            cfile = open( self.params.filepath, 'r' )
-        except:
-            print( 'cnorm: could not open file: ', self.params.filepath,
-                   file=sys.stderr)
+        coeffs = read_coefficients( self.params.filepath )
+        if coeffs == None:
             return
+        ntype, scale, offset = coeffs
 
-        items = cfile.readline().split(',')
-        numbands = int( items[0].strip() )
-        ntype = int( items[1].strip() )
-                       
         height,width,nbands = self.source.shape
-        if numbands != nbands:
+        if len( scale ) != nbands:
             print( 'cnorm: number of bands to not match', file=sys.stderr )
             return
         
-        # create output buffer
-        self.sink = np.empty( (height,width,nbands), dtype=np.float32 )
-
-        # normalize each band according to coefficients
-        for i in range( nbands ):
-            
-            line = cfile.readline()
-            items = line.split(',')
-
-            band = int( items[0].strip() )
-            scale = float( items[1].strip() )
-            offset = float( items[2].strip() )
-
-            self.sink[:,:,band] = self.scale_band( self.source[:,:,band],
-                                                   scale, offset, ntype )
+        # create output buffer, or reuse the source
+        if self.params.inplace and self.source.dtype == np.float32 \
+           and self.source.flags.writeable:
+            self.sink = self.source
+        else:
+            self.sink = np.empty( (height,width,nbands), dtype=np.float32 )
+
+        # normalize all bands at once, scale and offset broadcast over
+        # the band axis, clipped to bounds if asked
+        if self.params.clip:
+            scale_offset( self.source, scale, offset, self.sink, ntype, 1 )
+        else:
+            scale_offset( self.source, scale, offset, self.sink )
 
     ####################################################################
     # gui section
@@ -182,7 +219,9 @@ class cnorm( op_panel ):
     def usage( self ):
         print( 'usage: cnorm.py', file=sys.stderr )
         print( '       -h, --help', file=sys.stderr )
-        print( '       -f coeff_file', file=sys.stderr )
+        print( '       -f coeff_file, --file=coeff_file', file=sys.stderr )
+        print( '       -b, --inplace   normalize a float32 source in place',
+               file=sys.stderr )
         print( '       -p param_file, --params=param_file', file=sys.stderr )
         print( '       input is stdin, output is stdout', file=sys.stderr )
 
@@ -191,7 +230,8 @@ class cnorm( op_panel ):
         file_given = False
         
         try:                                
-            opts, args = getopt.getopt( argv, 'h:',['help'])
+            opts, args = getopt.getopt( argv, 'hf:p:b',
+                                        ['help','file=','params=','inplace'] )
             
         except getopt.GetoptError:           
             self.usage()                          
@@ -204,6 +244,8 @@ class cnorm( op_panel ):
             elif opt in ( '-f', '--file' ):
                 self.params.filepath = arg
                 file_given = True
+            elif opt in ( '-b', '--inplace' ):
+                self.params.inplace = True
             elif opt in ('-p', '--params'):
                 params = arg  
 
@@ -223,22 +265,12 @@ class cnorm( op_panel ):
 ####################################################################
 
 if __name__ == '__main__':
-    import os
-    import tempfile
+    from poli_stream import read_stream, write_stream
 
     oper = instantiate()   
     oper.set_params( sys.argv[1:] )
 
-    # numpy needs to 'seek' in the file to load
-    # so read from stdin to temporary file first
-    temp_name = next(tempfile._get_candidate_names()) + '.tmp'
-    temp = open( temp_name, 'wb' )
-    temp.write( sys.stdin.buffer.read() )
-    temp.close()
-
-    # load the pickled data
-    oper.source = np.load( temp_name, allow_pickle=True,fix_imports=False)
-    os.remove( temp_name )
+    read_stream( oper )           # receive from upstream
 
     oper.run()                  
-    oper.sink.dump( sys.stdout.buffer )          # send downstream    
+    write_stream( oper )          # send downstream    
@@ -96,10 +96,11 @@ class eto( op_panel ):                 # calculate_eto operator
 
         # data type
         if self.source.dtype != np.float32:
-            print >> sys.stderr, 'wrong data type, should be float32'
+            print( 'wrong data type, should be float32', file=sys.stderr )
             return
 
-        numy,numx,nbands = self.source.shape # get dimensions
+        # works on a (y,x,band) image or a (time,y,x,band) cube
+        nbands = self.source.shape[-1]       # get dimensions
 
         # input bands:
         # Rn     hourly averaged net radiation,            MJ/(m**2*hr)
@@ -117,16 +118,16 @@ class eto( op_panel ):                 # calculate_eto operator
             return
 
         # allocate output space; include lat and long
-        self.sink = np.empty( (numy,numx,3), dtype=np.float32 )
+        self.sink = np.empty( self.source.shape[:-1] + (3,), dtype=np.float32 )
 
-        self.sink[:,:,0 ] = self.calc_et_ref( self.source[:,:,0],
-                                              self.source[:,:,1],
-                                              self.source[:,:,2],
-                                              self.source[:,:,3],
-                                              self.source[:,:,4],
-                                              self.source[:,:,5],
-                                              self.source[:,:,6],
-                                              self.source[:,:,7] )
+        self.sink[...,0 ] = self.calc_et_ref( self.source[...,0],
+                                              self.source[...,1],
+                                              self.source[...,2],
+                                              self.source[...,3],
+                                              self.source[...,4],
+                                              self.source[...,5],
+                                              self.source[...,6],
+                                              self.source[...,7] )
 
         self.band_tags = ['ETo mm/hr']
 
@@ -177,22 +178,12 @@ class eto( op_panel ):                 # calculate_eto operator
 ####################################################################
 
 if __name__ == '__main__':
-    import os
-    import tempfile
+    from poli_stream import read_stream, write_stream
 
     oper = instantiate()
     oper.set_params( sys.argv[1:] )
 
-    # numpy needs to 'seek' in the file to load
-    # so read from stdin to temporary file first
-    temp_name = next(tempfile._get_candidate_names()) + '.tmp'
-    temp = open( temp_name, 'wb' )
-    temp.write( sys.stdin.buffer.read() )
-    temp.close()
-
-    # load the pickled data
-    oper.source = np.load( temp_name, allow_pickle=True,fix_imports=False)
-    os.remove( temp_name )
+    read_stream( oper )           # receive from upstream
  
     oper.run()                  
-    oper.sink.dump( sys.stdout.buffer )          # send downstream    
+    write_stream( oper )          # send downstream    
@@ -29,16 +29,29 @@ msom_copyright = 'msom.py Copyright (c) 2020-2022 Scott L. Williams, released un
 # self organizing map poli operator using minisom
 
 import wx
+import io
 import os
 import sys
+import ast
+import copy
 import math
+import time
 import getopt
 import datetime
+import itertools
+import multiprocessing
 import numpy as np
 
-from minisom import MiniSom, _build_iteration_indexes
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from minisom import MiniSom
 from op_panel import op_panel
 
+import som_engine
+from som_model import write_model, read_model, is_model_file, MODEL_SUFFIX
+from pixel_store import pixel_store, open_store, stratified_indices
+from telemetry import telemetry, progress_meter, peak_rss_mb
+
 # return an instance of 'msom' class 
 # without having to know its name
 def instantiate():	
@@ -63,6 +76,102 @@ def linear_decay( learning_rate, t, max_iter ):
 
 def power_decay( learning_rate, t, max_iter ):
     return learning_rate*(0.005/learning_rate)**(t/max_iter)
+
+# batch size used when training from files or unique
+# vectors without one set
+DEFAULT_BATCH_SIZE = 1024
+
+# a sweep file lists msom parameters to vary, one per line, with
+# their candidate values separated by commas. every combination is
+# trained, eg.
+#
+#   # 4 x 2 x 3 = 24 candidates
+#   shape = (4,4), (6,6), (8,8), (10,10)
+#   sigma = 1.0, 2.0
+#   seed = 1, 2, 3
+#
+# returns a list of (name, values) or None
+def read_sweep( filename ):
+    grid = []
+    known = vars( msom_parameters() )
+
+    try:
+        sfile = open( filename, 'r' )
+    except IOError as e:
+        print( e, file=sys.stderr )
+        return None
+
+    for number, line in enumerate( sfile, 1 ):
+        line = line.split( '#' )[0].strip()
+        if len( line ) == 0:
+            continue
+
+        name, sep, values = line.partition( '=' )
+        name = name.strip()
+        if sep == '' or name not in known:
+            print( 'msom: sweep file line', number, ': unknown parameter:',
+                   name, file=sys.stderr )
+            sfile.close()
+            return None
+
+        try:
+            values = ast.literal_eval( '[' + values + ']' )
+        except ( ValueError, SyntaxError ):
+            print( 'msom: sweep file line', number, ': bad values',
+                   file=sys.stderr )
+            sfile.close()
+            return None
+
+        grid.append( (name, values) )
+
+    sfile.close()
+    return grid
+
+def format_candidate( overrides ):
+    return ' '.join( [ '%s=%s'%(name, str( value ).replace( ' ', '' ))
+                       for name, value in overrides.items() ] )
+
+# set by msom.sweep before the process pool forks
+sweep_base = None
+sweep_data = None
+
+# train one sweep candidate in a worker process; returns the
+# overrides, errors, weights and neuron pixel counts
+def sweep_worker( overrides ):
+
+    # candidates run side by side; their messages are kept rather
+    # than interleaved, and reported for a candidate that fails
+    log = io.StringIO()
+    sys.stderr = log
+
+    oper = instantiate()
+    oper.params = copy.deepcopy( sweep_base )
+    for name, value in overrides.items():
+        setattr( oper.params, name, value )
+
+    oper.params.nworkers = 1          # parallel across candidates instead
+    oper.params.show_progress = False
+    oper.params.telemetry_file = None
+
+    # fit exits on bad input files; fail just this candidate
+    try:
+        som, QE, TE, labels, counts = oper.fit( sweep_data )
+    except ( Exception, SystemExit ) as e:
+        if isinstance( e, SystemExit ):
+            reason = 'exit %s'%e.code
+        else:
+            reason = str( e ) or type( e ).__name__
+
+        lines = [ l.strip() for l in log.getvalue().splitlines() if l.strip() ]
+        if len( lines ) > 0:
+            reason += ': ' + lines[-1]
+        return overrides, np.inf, np.inf, None, None, reason
+
+    weights = som.get_weights()
+    if labels is not None:
+        counts = np.bincount( labels, minlength=weights.shape[0]*weights.shape[1] )
+
+    return overrides, QE, TE, weights, counts, None
                  
 class msom_parameters():             # hold arguments values here
     def __init__( self ):
@@ -104,6 +213,8 @@ class msom_parameters():             # hold arguments values here
         # map file path prefix, a suffix is added 
         # for quantized and labels outputs later
         self.mapfile_prefix = 'msom_weights'
+        self.write_report = True      # also write the .labels text report
+                                      # beside the .npz model file
 
         # apply classifications to dataset?
         self.apply_classification = True
@@ -125,7 +236,48 @@ class msom_parameters():             # hold arguments values here
                                       # 5 = power
 
         self.show_progress = True
+        self.progress_interval = 1.0  # seconds between progress lines
         self.calc_epoch_errors = False    # calculate QE and TE after each epoch
+
+        self.telemetry_file = None    # append per epoch throughput, timings,
+                                      # errors and memory as json lines.
+                                      # epoch errors are then always computed
+
+        self.batch_size = 0           # pixels per batch update, 0 trains
+                                      # online one pixel at a time
+        self.nworkers = 0             # threads evaluating the map,
+                                      # 0 uses all cpus
+
+        self.training_files = []      # .npy images to train on instead of
+                                      # the source, glob patterns allowed.
+                                      # the source, if any, is then labeled
+                                      # with the trained map
+        self.chunk_size = 1048576     # pixels read from training files at
+                                      # a time
+
+        self.sample_size = 0          # train on a stratified sample of this
+                                      # many pixels, 0 trains on all
+        self.holdout_size = 0         # pixels held out of the sample to
+                                      # check convergence, 0 for no checks
+        self.check_interval = 10000   # training samples between checks
+        self.stop_threshold = 0.001   # stop when holdout QE improves by
+                                      # less than this fraction per check
+
+        self.warm_start = False       # fine tune the weights in
+                                      # custom_initfile with a short schedule
+        self.warm_sigma_factor = 0.25 # sigma and rate are scaled by these
+        self.warm_rate_factor = 0.25  # when warm starting
+        self.warm_nepochs = 1         # epochs when warm starting
+
+        self.dedupe = False           # train on unique pixel vectors
+                                      # weighted by their counts. an epoch
+                                      # then costs far less, so more
+                                      # nepochs are affordable
+        self.dedupe_step = 0.0        # round to multiples of this before
+                                      # comparing, 0 for exact duplicates
+
+        self.sweep_file = None        # train every parameter combination
+                                      # listed here, keep the best map
         
         # TODO: update GUI panel on new parameters
         
@@ -147,6 +299,7 @@ class msom_parameters():             # hold arguments values here
         print( 'activation distance=     ', self.activation_distance, file=nfile )
         print( 'output type=             ', self.output_type, file=nfile )
         print( 'mapfile_prefix=          ', self.mapfile_prefix, file=nfile )
+        print( 'write report=            ', self.write_report, file=nfile )
         print( 'apply classification=    ', self.apply_classification, file=nfile )
         print( 'activation map=          ', self.activation_map, file=nfile )
         print( 'activation map_prefix=   ', self.actmapfile_prefix, file=nfile )
@@ -155,13 +308,40 @@ class msom_parameters():             # hold arguments values here
         print( 'custom init file=        ', self.custom_initfile, file=nfile )
         print( 'decay function=          ', self.decay_function, file=nfile )
         print( 'show progress=           ', self.show_progress, file=nfile )
+        print( 'progress interval=       ', self.progress_interval, file=nfile )
         print( 'calc epoch errors=       ', self.calc_epoch_errors, file=nfile )
+        print( 'telemetry file=          ', self.telemetry_file, file=nfile )
+        print( 'batch size=              ', self.batch_size, file=nfile )
+        print( 'nworkers=                ', self.nworkers, file=nfile )
+        print( 'training files=          ', self.training_files, file=nfile )
+        print( 'chunk size=              ', self.chunk_size, file=nfile )
+        print( 'sample size=             ', self.sample_size, file=nfile )
+        print( 'holdout size=            ', self.holdout_size, file=nfile )
+        print( 'check interval=          ', self.check_interval, file=nfile )
+        print( 'stop threshold=          ', self.stop_threshold, file=nfile )
+        print( 'warm start=              ', self.warm_start, file=nfile )
+        print( 'warm sigma factor=       ', self.warm_sigma_factor, file=nfile )
+        print( 'warm rate factor=        ', self.warm_rate_factor, file=nfile )
+        print( 'warm nepochs=            ', self.warm_nepochs, file=nfile )
+        print( 'dedupe=                  ', self.dedupe, file=nfile )
+        print( 'dedupe step=             ', self.dedupe_step, file=nfile )
+        print( 'sweep file=              ', self.sweep_file, file=nfile )
                
 class msom( op_panel ):
     def __init__( self, name ):      # initialize op_panel but no graphics
         op_panel.__init__( self, name )
         self.op_id = 'msom version 0.0'
         self.params = msom_parameters()
+
+        self.holdout = None           # pixels for convergence checks
+        self.holdout_multiplicity = None
+        self.qe_curve = []            # (iteration, holdout QE) per check
+        self.stop_iteration = None    # where training stopped early
+        self.last_check = 0
+        self.drift = None             # (mean, max) weight drift of a warm start
+
+        self.log = telemetry()        # training telemetry, see telemetry_file
+        self.timing = {}              # seconds in winner search and update
     
     # write settings and neuron weights to file
     def writefile( self, QE, TE, weights, actmap ):
@@ -176,44 +356,59 @@ class msom( op_panel ):
                 sys.exit( 2 )
 
         try:
-            nfile = open( self.params.mapfile_prefix + '.labels', 'w' ) 
-            self.params.print_params( nfile )
+            # binary model read by somclass and custom init
+            write_model( self.params.mapfile_prefix + MODEL_SUFFIX,
+                         weights, self.params, QE, TE, actmap )
 
-            nfile.write( '\nquantization error=       %.8f\n'%QE )
-            nfile.write( 'topographic error=        %.8f\n'%TE )
-            
-            # flag for reading later
-            nfile.write( '\n############ NEURONS #############\n' )
-            
-            # report number of neurons and dimensionality                
-            nfile.write( '%3i'%(ny*nx) + ' %3i'%ndim + '\n' )
-
-            # report class weights and number of pixels in the class
-            label = 0
-            for j in range( ny ):
-                for i in range( nx ):
-                    
-                    # grey level (class label) used
-                    nfile.write( '%3i'%label + ' ' )  
-                    for k in range( ndim ):
-                        nfile.write(  '%10.6f'%weights[j,i,k] + ' ' )
-                    
-                    if isinstance( actmap, np.ndarray ):
-                        # report number of pixels in class
-                        nfile.write( '%3i\n'%actmap[j,i] )
-                    else:
-                        nfile.write( '\n' )
-                        
-                    label += 1
-            nfile.close()
+            if self.params.write_report:
+                self.write_report( QE, TE, weights, actmap )
 
             # write out activation map
             if isinstance( actmap, np.ndarray ):
-                actmap.dump( self.params.activation_map_prefix + '.npy' )
+                actmap.dump( self.params.actmapfile_prefix + '.npy' )
             
         except IOError:
             print( 'writefile: IOError', file=sys.stderr )
 
+    # human readable .labels report of settings and neuron weights
+    def write_report( self, QE, TE, weights, actmap ):
+
+        ny, nx, ndim = weights.shape
+
+        nfile = open( self.params.mapfile_prefix + '.labels', 'w' ) 
+        self.params.print_params( nfile )
+
+        nfile.write( '\nquantization error=       %.8f\n'%QE )
+        nfile.write( 'topographic error=        %.8f\n'%TE )
+
+        if self.drift != None:
+            nfile.write( 'weight drift mean=        %.8f\n'%self.drift[0] )
+            nfile.write( 'weight drift max=         %.8f\n'%self.drift[1] )
+
+        # convergence checks on the holdout sample
+        if len( self.qe_curve ) > 0:
+            nfile.write( '\nearly stop iteration=     %s\n'%self.stop_iteration )
+            nfile.write( 'holdout QE curve=\n' )
+            for t, qe in self.qe_curve:
+                nfile.write( '   %10i %.8f\n'%(t, qe) )
+            
+        # flag for reading later
+        nfile.write( '\n############ NEURONS #############\n' )
+            
+        # report number of neurons and dimensionality                
+        nfile.write( '%3i'%(ny*nx) + ' %3i'%ndim + '\n' )
+
+        # report grey level (class label), class weights
+        # and number of pixels in the class, one row per neuron
+        columns = [ np.arange( ny*nx ), weights.reshape( (ny*nx, ndim) ) ]
+        fmt = '%3i ' + '%10.6f '*ndim
+        if isinstance( actmap, np.ndarray ):
+            columns.append( actmap.reshape( -1 ) )
+            fmt += '%3i'
+
+        np.savetxt( nfile, np.column_stack( columns ), fmt=fmt )
+        nfile.close()
+
     # match image sample to closest map weights
     def classify( self, weights, image ):
 
@@ -224,48 +419,34 @@ class msom( op_panel ):
                               (weights.shape[0]*weights.shape[1],
                                weights.shape[2]) )
 
-        num_neurons,nnbands = neurons.shape
-        height,width,nbands = image.shape
-
-        if nnbands != nbands:
-            print('somclass: dimensions do not match',
-                  nnbands, nbands, file=sys.stderr )
-            return None
-
-        # set up arrays
-        min = np.empty( (height,width,1), dtype=np.float32 )
-        new = np.empty( (height,width,1), dtype=np.float32 )
+        # use the same distance the map was trained with;
+        # large maps are searched through a kd-tree
+        metric = self.params.activation_distance
+        return som_engine.classify( neurons, image, metric,
+                                    index=som_engine.build_index( neurons, metric ) )
 
-        # initialize to the zeroth neuron
-        classified = np.zeros( (height,width,1), dtype=np.uint8 )
-
-        diff = image-neurons[0]        # initialize min array
-        diff = np.abs( diff )          # using no-square euclid metric
-        min = np.sum( diff, axis=2 )   # TODO: determine metric and use
-
-        for i in range( 1,num_neurons ):    # test each neuron.
-            diff = image-neurons[i]         # keep track of minimal distances
-            diff = np.abs( diff )           # and compare/adjust with each 
-            new = np.sum( diff, axis=2 )    # new distance array
-
-            mask = min > new
-
-            np.putmask( min, mask, new )       # use same mask to
-            np.putmask( classified, mask, i  ) # keep track of class
+    def init_SOM( self, nbands ) :
 
-        return classified
+        sigma = self.params.sigma
+        rate = self.params.rate
 
-    def init_SOM( self, nbands ) :
+        # fine tuning an existing map starts from a narrow
+        # neighborhood and a low rate
+        if self.params.warm_start:
+            sigma *= self.params.warm_sigma_factor
+            rate *= self.params.warm_rate_factor
+            print( 'warm start: sigma=', sigma, 'rate=', rate,
+                   file=sys.stderr, flush=True )
         
         if self.params.decay_function == 0:
 
             # use default decay_function
             print( 'using default asymptotic decay function', file=sys.stderr, flush=True )
             som = MiniSom( self.params.shape[1], self.params.shape[0],
-                           nbands, sigma=self.params.sigma,
+                           nbands, sigma=sigma,
                            neighborhood_function=self.params.neighborhood_function,
                            activation_distance=self.params.activation_distance,
-                           learning_rate=self.params.rate,
+                           learning_rate=rate,
                            random_seed=self.params.seed )
 
         else:
@@ -294,10 +475,10 @@ class msom( op_panel ):
                 raise ValueError( 'msom: unknown decay function' )
 
             som = MiniSom( self.params.shape[1], self.params.shape[0],
-                           nbands, sigma=self.params.sigma,
+                           nbands, sigma=sigma,
                            neighborhood_function=self.params.neighborhood_function,
                            activation_distance=self.params.activation_distance,
-                           learning_rate=self.params.rate,
+                           learning_rate=rate,
                            random_seed=self.params.seed,
                            decay_function=decay_function )
 
@@ -305,24 +486,38 @@ class msom( op_panel ):
 
     # initialize the neuron weights
     def init_weights( self, som, pixels ):
+
+        # a warm start always begins from the prior map
+        init_weights = self.params.init_weights
+        if self.params.warm_start:
+            init_weights = 'custom'
         
-        if self.params.init_weights == 'random':
+        if init_weights == 'random':
             
             print( 'random initializing neuron weights...',
                    end='',file=sys.stderr, flush=True )
             som.random_weights_init( pixels )
             
-        elif self.params.init_weights == 'pca':
+        elif init_weights == 'pca':
             
             print( 'pca initializing neuron weights...',
                    end='',file=sys.stderr, flush=True )
             som.pca_weights_init( pixels )
             
-        elif self.params.init_weights == 'custom':
+        elif init_weights == 'custom':
         
             print( 'custom initializing neuron weights...',
                    end='',file=sys.stderr, flush=True )
 
+            if self.params.custom_initfile == None:
+                print( '\nmsom: no custom init file given', file=sys.stderr )
+                sys.exit(2)
+
+            if is_model_file( self.params.custom_initfile ):
+                self.read_init_model( som )
+                print( 'done', file=sys.stderr, flush=True )
+                return
+
             # read custom weight file
             wfile = open( self.params.custom_initfile, 'r' ) 
 
@@ -362,11 +557,388 @@ class msom( op_panel ):
 
         print( 'done', file=sys.stderr, flush=True )
 
+    # update the map with a batch of pixels at iteration t. winners
+    # for the batch are found in one vectorized call and each neuron
+    # moves toward the neighborhood weighted mean of the pixels won
+    # around it. decay is evaluated at the batch start.
+    def batch_update( self, som, batch, t, nsamples, multiplicity=None ):
+
+        nx, ny, nbands = som._weights.shape
+        neurons = som._weights.reshape( (nx*ny, nbands) )
+
+        # minisom 2.3.2 on decays learning rate and sigma with their
+        # own functions; earlier releases use one for both
+        rate_decay = getattr( som, '_learning_rate_decay_function', None )
+        sigma_decay = getattr( som, '_sigma_decay_function', None )
+        if rate_decay == None:
+            rate_decay = som._decay_function
+        if sigma_decay == None:
+            sigma_decay = som._decay_function
+
+        eta = rate_decay( som._learning_rate, t, nsamples )
+        sig = sigma_decay( som._sigma, t, nsamples )
+
+        start = time.perf_counter()
+        winners = som_engine.nearest( neurons, batch,
+                                      self.params.activation_distance )
+        found = time.perf_counter()
+
+        units, inverse = np.unique( winners, return_inverse=True )
+        inverse = inverse.reshape( -1 )
+
+        # pixel counts and sums per winning neuron; a row
+        # with multiplicity counts that many times
+        if multiplicity is None:
+            counts = np.bincount( inverse, minlength=len( units ) )
+        else:
+            counts = np.bincount( inverse, weights=multiplicity,
+                                  minlength=len( units ) )
+
+        sums = np.empty( (len( units ), nbands) )
+        for k in range( nbands ):
+            values = batch[:,k]
+            if multiplicity is not None:
+                values = values*multiplicity
+            sums[:,k] = np.bincount( inverse, weights=values,
+                                     minlength=len( units ) )
+
+        # neighborhood of each winner over the whole map
+        hood = np.empty( (len( units ), nx*ny) )
+        for i, unit in enumerate( units ):
+            win = np.unravel_index( unit, (nx,ny) )
+            hood[i] = som.neighborhood( win, sig ).reshape( -1 )
+
+        num = hood.T @ sums
+        den = hood.T @ counts
+
+        # w += eta*sum( h*(x-w) ), normalized so a large batch
+        # moves a neuron no further than its weighted mean
+        num -= den[:,np.newaxis]*neurons
+        num /= np.maximum( den, 1.0 )[:,np.newaxis]
+        neurons += eta*num
+
+        som._weights = neurons.reshape( (nx,ny,nbands) )
+
+        self.timing['winner'] += found - start
+        self.timing['update'] += time.perf_counter() - found
+
+    # check holdout QE every check_interval iterations;
+    # true when it has stopped improving
+    def converged( self, som, t ):
+        if self.holdout is None:
+            return False
+
+        if t - self.last_check < self.params.check_interval:
+            return False
+        self.last_check = t
+
+        QE = self.evaluate( som, self.holdout, self.holdout_multiplicity )[0]
+        self.qe_curve.append( (t, QE) )
+        print( '\nholdout QE=', QE, 'at', t, file=sys.stderr, flush=True )
+
+        if len( self.qe_curve ) < 2:
+            return False
+
+        # a plateau, not a rise; QE can grow while the
+        # neighborhood is still wide
+        last = self.qe_curve[-2][1]
+        if last > 0 and 0 <= (last - QE)/last < self.params.stop_threshold:
+            print( 'converged, stopping at', t, file=sys.stderr, flush=True )
+            self.stop_iteration = t
+            return True
+
+        return False
+
+    # one pass over the data a batch of pixels at a time;
+    # true if training converged
+    def batch_epoch( self, som, data, order, t0, nsamples, show_progress,
+                     multiplicity=None ):
+
+        ndata = len( data )
+        batch_size = self.params.batch_size
+        if batch_size <= 0:
+            batch_size = DEFAULT_BATCH_SIZE
+
+        meter = progress_meter( ndata, self.params.progress_interval,
+                                show_progress )
+
+        mult = None
+        t = t0                        # counts pixels, not rows
+        for start in range( 0, ndata, batch_size ):
+            stop = min( start+batch_size, ndata )
+
+            if order is None:
+                batch = data[start:stop]
+                if multiplicity is not None:
+                    mult = multiplicity[start:stop]
+            else:
+                batch = data[order[start:stop]]
+                if multiplicity is not None:
+                    mult = multiplicity[order[start:stop]]
+
+            self.batch_update( som, batch, t, nsamples, mult )
+
+            if mult is None:
+                t += len( batch )
+            else:
+                t += int( np.sum( mult ) )
+
+            meter.update( stop )
+
+            if self.converged( som, t ):
+                meter.finish()
+                return True
+
+        meter.finish()
+        return False
+
+    # one pass over a pixel store, reading a block at a time
+    def store_epoch( self, som, store, t0, nsamples, random_generator,
+                     show_progress ):
+
+        ndata = len( store )
+        batch_size = self.params.batch_size
+        if batch_size <= 0:
+            batch_size = DEFAULT_BATCH_SIZE
+
+        meter = progress_meter( ndata, self.params.progress_interval,
+                                show_progress )
+
+        done = 0
+        for block in store.blocks( self.params.chunk_size, random_generator ):
+            for start in range( 0, len( block ), batch_size ):
+                self.batch_update( som, block[start:start+batch_size],
+                                   t0 + done + start, nsamples )
+            done += len( block )
+            meter.update( done )
+
+        meter.finish()
+
+    # per epoch errors are needed for the report or telemetry
+    def epoch_errors( self ):
+        return self.params.calc_epoch_errors or self.log.active()
+
+    def start_epoch( self ):
+        self.timing = { 'winner' : 0.0, 'update' : 0.0 }
+        self.epoch_start = time.perf_counter()
+
+    # record an epoch's throughput, timings, errors and memory.
+    # the errors of the last epoch are in the final record
+    def end_epoch( self, epoch, nsamples, QE, TE ):
+        seconds = time.perf_counter() - self.epoch_start
+
+        self.log.record( 'epoch', epoch=epoch, samples=nsamples,
+                         seconds=seconds,
+                         samples_per_second=nsamples/max( seconds, 1e-9 ),
+                         winner_seconds=self.timing['winner'],
+                         update_seconds=self.timing['update'],
+                         qe=QE, te=TE, peak_rss_mb=peak_rss_mb() )
+
+    # number of pixels whose best and second best neurons are not
+    # neighbors on the map; with multiplicity, each pixel counts that
+    # many times
+    def topographic_errors( self, som, best, second, multiplicity=None ):
+        nx, ny = som._weights.shape[:2]
+
+        if som.topology == 'hexagonal':
+            bx, by = som.convert_map_to_euclidean( np.unravel_index( best, (nx,ny) ) )
+            sx, sy = som.convert_map_to_euclidean( np.unravel_index( second, (nx,ny) ) )
+            far = ~( ( np.abs( bx-sx ) <= 1 ) & ( np.abs( by-sy ) <= 1 ) )
+        else:
+            bx, by = np.unravel_index( best, (nx,ny) )
+            sx, sy = np.unravel_index( second, (nx,ny) )
+            far = np.hypot( bx-sx, by-sy ) > 1.42
+
+        if multiplicity is None:
+            return np.count_nonzero( far )
+        return np.sum( multiplicity[far] )
+
+    # quantization error, topographic error and the winning neuron of
+    # every pixel from one shared best/second best neuron search in
+    # the map's activation distance, chunked over a thread pool. the
+    # quantization error is the euclidean distance to the winner, as
+    # in minisom. with multiplicity, each pixel row stands for that
+    # many pixels.
+    def evaluate( self, som, data, multiplicity=None ):
+        nx, ny, nbands = som._weights.shape
+        neurons = som._weights.reshape( (nx*ny, nbands) )
+        metric = self.params.activation_distance
+
+        def work( start, stop ):
+            chunk = data[start:stop]
+            best, second = som_engine.nearest_two( neurons, chunk, metric )
+
+            mult = None
+            error = np.linalg.norm( chunk - neurons[best], axis=1 )
+            if multiplicity is None:
+                qe = error.sum()
+            else:
+                mult = multiplicity[start:stop]
+                qe = np.dot( error, mult )
+            te = self.topographic_errors( som, best, second, mult )
+
+            return best, qe, te
+
+        results = som_engine.map_chunks( work, len( data ), self.params.nworkers )
+
+        npix = len( data )
+        if multiplicity is not None:
+            npix = np.sum( multiplicity )
+
+        labels = np.concatenate( [ r[0] for r in results ] )
+        QE = sum( r[1] for r in results )/npix
+        TE = sum( r[2] for r in results )/npix
+
+        if nx*ny == 1:
+            TE = np.nan               # not defined for a 1x1 map
+
+        return QE, TE, labels
+
+    # initialize neuron weights from a binary model file
+    def read_init_model( self, som ):
+        model = read_model( self.params.custom_initfile )
+        if model == None:
+            sys.exit(2)
+
+        if model.weights.size != som._weights.size:
+            print( 'msom: custom init model does not match map shape',
+                   model.weights.shape, som._weights.shape, file=sys.stderr )
+            sys.exit(2)
+
+        som._weights[...] = model.neurons().reshape( som._weights.shape )
+
+    # errors over all data, an array or a pixel store. returns the
+    # errors with either the winner of every pixel (array) or the
+    # per neuron pixel counts (store)
+    def final_errors( self, som, data, multiplicity=None ):
+        labels = None
+        counts = None
+
+        print( '\ncalculating quantization and topographic errors...',
+               file=sys.stderr, end='', flush=True )
+        start = time.perf_counter()
+        if isinstance( data, pixel_store ):
+            QE, TE, counts = self.evaluate_store( som, data )
+        else:
+            QE, TE, labels = self.evaluate( som, data, multiplicity )
+        self.log.record( 'errors', qe=QE, te=TE,
+                         seconds=time.perf_counter() - start,
+                         peak_rss_mb=peak_rss_mb() )
+        print( 'done.', file=sys.stderr, flush=True )
+        print( 'quantization error=', QE, file=sys.stderr,  flush=True )
+        print( 'topographic error=', TE, '\n', file=sys.stderr,  flush=True )
+
+        return QE, TE, labels, counts
+
+    # errors and per neuron pixel counts over a pixel store
+    def evaluate_store( self, som, store ):
+        nneurons = som._weights.shape[0]*som._weights.shape[1]
+
+        QE = 0.0
+        TE = 0.0
+        counts = np.zeros( nneurons )
+        for block in store.blocks( self.params.chunk_size ):
+            qe, te, labels = self.evaluate( som, block )
+            QE += qe*len( block )
+            TE += te*len( block )
+            counts += np.bincount( labels, minlength=nneurons )
+
+        return QE/len( store ), TE/len( store ), counts
+
+    # train over a pixel store using epoch intervals
+    def store_train( self, som, store, nepochs, rorder, show_progress ):
+
+        ndata = len( store )
+        nsamples = nepochs*ndata
+
+        random_generator = None
+        if rorder == True:
+            random_generator = som._random_generator
+
+        for epoch in range( nepochs ):
+
+            print( '\nepoch =', epoch, file=sys.stderr, flush=True )
+            self.start_epoch()
+            self.store_epoch( som, store, ndata*epoch, nsamples,
+                              random_generator, show_progress )
+
+            # if calculating epoch QE don't do last one
+            QE = TE = None
+            if self.epoch_errors() and epoch < nepochs-1:
+                QE, TE, counts = self.evaluate_store( som, store )
+                print( '\nQE=', QE, file=sys.stderr, flush=True )
+                print( 'TE=', TE, file=sys.stderr, flush=True )
+
+            self.end_epoch( epoch, ndata, QE, TE )
+
+        QE, TE, labels, counts = self.final_errors( som, store )
+        return QE, TE, counts
+
     # train using epoch intervals
-    def epoch_train( self, som, data, nepochs, rorder, show_progress ):
+    def epoch_train( self, som, data, nepochs, rorder, show_progress,
+                     multiplicity=None ):
+
+        self.train_epochs( som, data, nepochs, rorder, show_progress,
+                           multiplicity )
+
+        QE, TE, labels, counts = self.final_errors( som, data, multiplicity )
+        return QE, TE, labels
+
+    # train on a stratified sample of the data, checking convergence
+    # on a held out sample. errors are then computed over all data.
+    def sample_train( self, som, data, nepochs, rorder, show_progress,
+                      multiplicity=None ):
+
+        random_generator = som._random_generator
+
+        ndata = len( data )
+        nsample = min( self.params.sample_size, ndata )
+        nholdout = min( self.params.holdout_size, ndata - nsample )
+
+        # spread both samples over the data, then split at random
+        indices = stratified_indices( ndata, nsample+nholdout, random_generator )
+        indices = indices[random_generator.permutation( len( indices ) )]
+
+        if isinstance( data, pixel_store ):
+            sample = data.gather( indices[:nsample] )
+            holdout = data.gather( indices[nsample:] )
+        else:
+            sample = data[np.sort( indices[:nsample] )]
+            holdout = data[np.sort( indices[nsample:] )]
+
+        # samples of unique vectors keep their counts
+        smult = None
+        if multiplicity is not None:
+            smult = multiplicity[np.sort( indices[:nsample] )]
+            self.holdout_multiplicity = multiplicity[np.sort( indices[nsample:] )]
+
+        print( 'training on a sample of', nsample, 'pixels, holding out',
+               nholdout, file=sys.stderr, flush=True )
+
+        if nholdout > 0:
+            self.holdout = holdout
+        self.last_check = 0
+
+        self.train_epochs( som, sample, nepochs, rorder, show_progress, smult )
+        self.holdout = None
+        self.holdout_multiplicity = None
+
+        return self.final_errors( som, data, multiplicity )
+
+    # train using epoch intervals, no error report
+    # with multiplicity, training is batched and each row counts
+    # as many pixels
+    def train_epochs( self, som, data, nepochs, rorder, show_progress,
+                      multiplicity=None ):
         
         ndata = len( data )           # number of data points
         nsamples = nepochs*ndata      # number of total sample points (iterations)
+
+        # unique vectors run the schedule over the pixels they stand for
+        npixels = ndata
+        if multiplicity is not None:
+            npixels = int( np.sum( multiplicity ) )
+            nsamples = nepochs*npixels
         
         random_generator = None                                                              
         if rorder == True:                                                                   
@@ -378,59 +950,308 @@ class msom( op_panel ):
         for epoch in range( nepochs ):
 
             print( '\nepoch =', epoch, file=sys.stderr, flush=True )
-            iterations = _build_iteration_indexes( ndata, ndata, 
-                                                   show_progress, random_generator )
-        
-            for t, iteration in enumerate( iterations ):
-                som.update( data[iteration], som.winner( data[iteration] ),
-                            ndata*epoch + t, nsamples )
+            self.start_epoch()
+
+            if self.params.batch_size > 0 or multiplicity is not None:
+                order = None
+                if random_generator != None:
+                    order = random_generator.permutation( ndata )
+
+                stop = self.batch_epoch( som, data, order, npixels*epoch,
+                                         nsamples, show_progress, multiplicity )
+            else:
+                stop = False
+
+                # same visiting order as minisom, without its
+                # per iteration progress printing
+                if random_generator != None:
+                    iterations = random_generator.permutation( ndata )
+                else:
+                    iterations = np.arange( ndata )
+
+                meter = progress_meter( ndata, self.params.progress_interval,
+                                        show_progress )
+                winner_time = 0.0
+                update_time = 0.0
+                for t, iteration in enumerate( iterations ):
+                    start = time.perf_counter()
+                    winner = som.winner( data[iteration] )
+                    found = time.perf_counter()
+                    som.update( data[iteration], winner,
+                                ndata*epoch + t, nsamples )
+                    winner_time += found - start
+                    update_time += time.perf_counter() - found
+
+                    meter.update( t+1 )
+                    if self.converged( som, ndata*epoch + t+1 ):
+                        stop = True
+                        break
+
+                meter.finish()
+                self.timing['winner'] += winner_time
+                self.timing['update'] += update_time
+
+            if stop:
+                self.end_epoch( epoch, npixels, None, None )
+                break
                 
             # if calculating epoch QE don't do last one
-            if self.params.calc_epoch_errors and epoch < nepochs-1:
-                QE = som.quantization_error( data )
+            QE = TE = None
+            if self.epoch_errors() and epoch < nepochs-1:
+                QE, TE, labels = self.evaluate( som, data, multiplicity )
                 print( '\nQE=', QE, file=sys.stderr, flush=True )
-                TE = som.topographic_error( data )
                 print( 'TE=', TE, file=sys.stderr, flush=True )
 
-        print( '\ncalculating quantization error...', file=sys.stderr, end='', flush=True )
-        QE = som.quantization_error( data )
-        print( 'done.', file=sys.stderr, flush=True )
-        print( 'quantization error=', QE, file=sys.stderr,  flush=True )
+            self.end_epoch( epoch, npixels, QE, TE )
 
-        print( '\ncalculating topographic error....', file=sys.stderr, end='', flush=True )
-        TE = som.topographic_error( data ) 
-        print( 'done.', file=sys.stderr, flush=True )
-        print( 'topographic error=', TE, '\n', file=sys.stderr,  flush=True )
+    # collapse duplicate pixel vectors, optionally after rounding to
+    # dedupe_step. returns the unique vectors (the mean of each group),
+    # the index of each pixel's vector and the group sizes
+    def dedupe( self, pixels ):
+        step = self.params.dedupe_step
+
+        if step > 0:
+            keys = np.round( pixels/step ).astype( np.int64 )
+        else:
+            keys = pixels
 
-        return QE, TE
+        keys, inverse, counts = np.unique( keys, axis=0, return_inverse=True,
+                                           return_counts=True )
+        inverse = inverse.reshape( -1 )
+
+        if step <= 0:
+            return keys, inverse, counts
+
+        unique = np.empty( (len( counts ), pixels.shape[1]), dtype=pixels.dtype )
+        for k in range( pixels.shape[1] ):
+            unique[:,k] = np.bincount( inverse, weights=pixels[:,k] )/counts
+
+        return unique, inverse, counts
+
+    # pixels to train on: the memory mapped training files, if
+    # given, or the source image. returns None on failure
+    def training_data( self ):
+
+        if len( self.params.training_files ) > 0:
+            store = open_store( self.params.training_files )
+            if store == None:
+                return None
+
+            print( 'training on', len( store ), 'pixels from',
+                   len( store.arrays ), 'files', file=sys.stderr, flush=True )
+            return store
 
-    def run( self ):                 # override superclass run      
-     
         # flatten the input image; just a stream of pixels with n-bands
         shape = self.source.shape
         npix = shape[0]*shape[1]
-        pixels = np.reshape( self.source, (npix, shape[2]) )
+        return np.reshape( self.source, (npix, shape[2]) )
+
+    # train a map on the data. returns the trained som, quantization
+    # and topographic errors and the winning neuron of each pixel or,
+    # for training files, the pixel count of each neuron
+    def fit( self, data ):
+
+        self.qe_curve = []
+        self.stop_iteration = None
+
+        if isinstance( data, pixel_store ):
+            nbands = data.nbands
+        else:
+            nbands = data.shape[1]
+
+        self.log = telemetry( self.params.telemetry_file, self.op_id )
+        self.log.record( 'start', pixels=len( data ), bands=nbands,
+                         params=vars( self.params ) )
+        start = time.perf_counter()
 
         # instantiate minisom
-        som = self.init_SOM( shape[2] )
+        som = self.init_SOM( nbands )
         
-        # initialize the neuron weights
-        self.init_weights( som, pixels )
+        # initialize the neuron weights; from a sample the size
+        # of a block for training files
+        if isinstance( data, pixel_store ):
+            self.init_weights( som, data.sample( self.params.chunk_size,
+                                                 som._random_generator ) )
+        else:
+            self.init_weights( som, data )
+
+        # train on unique vectors weighted by their counts
+        inverse = None
+        multiplicity = None
+        if self.params.dedupe:
+            if isinstance( data, pixel_store ):
+                print( 'msom: dedupe is not applied to training files',
+                       file=sys.stderr, flush=True )
+            else:
+                npix = len( data )
+                data, inverse, multiplicity = self.dedupe( data )
+                print( 'dedupe:', npix, 'pixels to', len( data ),
+                       'unique vectors', file=sys.stderr, flush=True )
+
+        nepochs = self.params.nepochs
+        if self.params.warm_start:
+            nepochs = self.params.warm_nepochs
+            initial = som._weights.copy()
         
-        # cluster (train) the image data, return quantization and topographic errors
-        QE, TE = self.epoch_train( som, pixels, self.params.nepochs,
-                                   self.params.rorder, self.params.show_progress )
+        # cluster (train) the data
+        labels = None
+        counts = None
+        if self.params.sample_size > 0:
+            QE, TE, labels, counts = self.sample_train( som, data, nepochs,
+                                                        self.params.rorder,
+                                                        self.params.show_progress,
+                                                        multiplicity )
+        elif isinstance( data, pixel_store ):
+            QE, TE, counts = self.store_train( som, data, nepochs,
+                                               self.params.rorder,
+                                               self.params.show_progress )
+        else:
+            QE, TE, labels = self.epoch_train( som, data, nepochs,
+                                               self.params.rorder,
+                                               self.params.show_progress,
+                                               multiplicity )
+
+        # labels of unique vectors back to every pixel
+        if inverse is not None:
+            labels = labels[inverse]
+
+        # how far fine tuning moved the prior map; a large drift
+        # suggests a full retrain
+        self.drift = None
+        if self.params.warm_start:
+            moved = np.linalg.norm( som._weights - initial, axis=2 )
+            self.drift = ( moved.mean(), moved.max() )
+            print( 'weight drift: mean=', self.drift[0], 'max=', self.drift[1],
+                   file=sys.stderr, flush=True )
+
+        self.log.record( 'end', seconds=time.perf_counter() - start,
+                         qe=QE, te=TE, stop_iteration=self.stop_iteration,
+                         peak_rss_mb=peak_rss_mb() )
+        self.log.close()
+
+        return som, QE, TE, labels, counts
+
+    # train every candidate of the sweep file concurrently and return
+    # the best by QE, then TE: its parameters, weights, errors and
+    # neuron pixel counts. writes a ranked summary to
+    # <mapfile_prefix>.sweep. returns None on failure
+    def sweep( self, data ):
+        global sweep_base, sweep_data
+
+        grid = read_sweep( self.params.sweep_file )
+        if grid == None:
+            return None
 
-        # get trained neuron weights and write to file
-        print( 'getting weights...', file=sys.stderr, end='', flush=True )
-        weights = som.get_weights()
-        print( 'done', file=sys.stderr, flush=True )
+        names = [ name for name, values in grid ]
+        candidates = [ dict( zip( names, values ) )
+                       for values in itertools.product( *[ v for n, v in grid ] ) ]
+
+        nworkers = self.params.nworkers
+        if nworkers <= 0:
+            nworkers = os.cpu_count() or 1
+        nworkers = min( nworkers, len( candidates ) )
+
+        print( 'sweep:', len( candidates ), 'candidates on', nworkers,
+               'processes', file=sys.stderr, flush=True )
+
+        # forked workers see the pixels without a copy
+        sweep_base = self.params
+        sweep_data = data
+
+        results = []
+        context = multiprocessing.get_context( 'fork' )
+        with ProcessPoolExecutor( max_workers=nworkers,
+                                  mp_context=context ) as pool:
+            futures = [ pool.submit( sweep_worker, c ) for c in candidates ]
+            for future in as_completed( futures ):
+                result = future.result()
+                results.append( result )
+                print( 'sweep: %d/%d'%(len( results ), len( candidates )),
+                       format_candidate( result[0] ),
+                       'QE=', result[1], 'TE=', result[2],
+                       file=sys.stderr, flush=True )
+                if result[5] != None:
+                    print( 'sweep: failed:', result[5], file=sys.stderr,
+                           flush=True )
+
+        sweep_base = None
+        sweep_data = None
+
+        # rank by quantization error, then topographic error
+        results.sort( key=lambda r: ( r[1], np.inf if np.isnan( r[2] ) else r[2] ) )
+        self.write_sweep( results )
+
+        overrides, QE, TE, weights, counts, error = results[0]
+        if weights is None:
+            print( 'msom: every sweep candidate failed', file=sys.stderr )
+            return None
+
+        best = copy.deepcopy( self.params )
+        for name, value in overrides.items():
+            setattr( best, name, value )
+
+        print( 'sweep: best', format_candidate( overrides ), 'QE=', QE,
+               'TE=', TE, file=sys.stderr, flush=True )
+        return best, weights, QE, TE, counts
+
+    # ranked sweep results as a text table
+    def write_sweep( self, results ):
+        try:
+            sfile = open( self.params.mapfile_prefix + '.sweep', 'w' )
+            sfile.write( '# sweep file: %s\n'%self.params.sweep_file )
+            sfile.write( '# rank         QE         TE  candidate\n' )
+
+            for rank, ( overrides, QE, TE, weights, counts, error ) in enumerate( results, 1 ):
+                line = '%6i %10.6f %10.6f  %s'%( rank, QE, TE,
+                                                format_candidate( overrides ) )
+                if error != None:
+                    line += '  failed: ' + error
+                sfile.write( line + '\n' )
+
+            sfile.close()
+
+        except IOError:
+            print( 'write_sweep: IOError', file=sys.stderr )
+
+    def run( self ):                 # override superclass run      
+
+        data = self.training_data()
+        if data is None:
+            return
+
+        labels = None
+        params = self.params
+
+        if self.params.sweep_file != None:
+            result = self.sweep( data )
+            if result == None:
+                return
+
+            # write and apply the winning map with its own parameters
+            self.params, weights, QE, TE, counts = result
+
+        else:
+            som, QE, TE, labels, counts = self.fit( data )
+
+            # get trained neuron weights and write to file
+            print( 'getting weights...', file=sys.stderr, end='', flush=True )
+            weights = som.get_weights()
+            print( 'done', file=sys.stderr, flush=True )
+
+        self.apply_map( weights, QE, TE, labels, counts )
+        self.params = params
+
+    # write the trained map and produce the output image
+    def apply_map( self, weights, QE, TE, labels, counts ):
 
         actmap = None
         if self.params.activation_map == True:
             print( 'getting pixel class frequency...',
                    file=sys.stderr, end='', flush=True )
-            actmap = som.activation_response( pixels )
+            if labels is not None:
+                counts = np.bincount( labels,
+                                      minlength=weights.shape[0]*weights.shape[1] )
+            actmap = counts.reshape( weights.shape[:2] ).astype( float )
             print( 'done', file=sys.stderr, flush=True )
 
         # write parameter values and class weights to file
@@ -438,23 +1259,31 @@ class msom( op_panel ):
 
         if self.params.apply_classification == False:
             return
-        
+
+        # trained from files or in a sweep; label the
+        # source if there is one
+        if not isinstance( self.source, np.ndarray ):
+            return
+
+        shape = self.source.shape
+        if labels is None:
+            labels = self.classify( weights, self.source ).reshape( -1 )
+
         if self.params.output_type == 'labels' :
 
-            # classify the image with index labels 
+            # label the image with the winning neurons
             print( 'labeling...', end='', file=sys.stderr, flush=True )
-            self.sink = self.classify( weights, self.source )
+            self.sink = som_engine.label_image( labels, shape[0], shape[1],
+                                                weights.shape[0]*weights.shape[1] )
             print( 'done', file=sys.stderr )
             
         elif self.params.output_type == 'quantize' :
             
             print( 'quantization...', end='', file=sys.stderr, flush=True )
-            qnt = som.quantization( pixels )  # quantize each pixel of the image
 
-            # place the quantized values into a new image
-            self.sink = np.zeros( self.source.shape, dtype=pixels.dtype )
-            for i, q in enumerate(qnt):      
-                self.sink[ np.unravel_index(i, dims=(shape[0],shape[1])) ] = q
+            # replace each pixel with its winning neuron's weights
+            neurons = np.reshape( weights, (-1, shape[2]) ).astype( self.source.dtype )
+            self.sink = neurons[labels].reshape( shape )
             print( 'done', file=sys.stderr )
 
         else:
@@ -495,6 +1324,30 @@ class msom( op_panel ):
         self.params.sigma = float( self.t_sigma.GetValue() )
         self.params.nepochs = int( self.t_nepochs.GetValue() )
         self.params.rate = float( self.t_rate.GetValue() )
+        self.params.batch_size = int( self.t_batch_size.GetValue() )
+        self.params.nworkers = int( self.t_nworkers.GetValue() )
+
+        # sampling and early stop
+        self.params.sample_size = int( self.t_sample_size.GetValue() )
+        self.params.holdout_size = int( self.t_holdout_size.GetValue() )
+        self.params.check_interval = int( self.t_check_interval.GetValue() )
+        self.params.stop_threshold = float( self.t_stop_threshold.GetValue() )
+
+        # warm start from the weights in the init file
+        self.params.warm_start = self.c_warm_start.GetValue()
+        self.params.warm_sigma_factor = float( self.t_warm_sigma_factor.GetValue() )
+        self.params.warm_rate_factor = float( self.t_warm_rate_factor.GetValue() )
+        self.params.warm_nepochs = int( self.t_warm_nepochs.GetValue() )
+
+        # unique pixel training
+        self.params.dedupe = self.c_dedupe.GetValue()
+        self.params.dedupe_step = float( self.t_dedupe_step.GetValue() )
+
+        initfile = self.t_custom_initfile.GetValue().strip()
+        if initfile == '':
+            self.params.custom_initfile = None
+        else:
+            self.params.custom_initfile = initfile
 
         # neighborhood function
         if self.r_gaussian.GetValue():
@@ -511,6 +1364,8 @@ class msom( op_panel ):
             self.params.init_weights = 'random'
         if self.r_pca.GetValue():
             self.params.init_weights = 'pca'
+        if self.r_custom.GetValue():
+            self.params.init_weights = 'custom'
 
         # topology
         if self.r_rectangular.GetValue():
@@ -562,12 +1417,38 @@ class msom( op_panel ):
         self.params.mapfile_prefix = self.t_mapfile_prefix.GetValue()
         self.params.actmapfile_prefix = self.t_actmapfile_prefix.GetValue()
 
+        telemetry_file = self.t_telemetry_file.GetValue().strip()
+        if telemetry_file == '':
+            self.params.telemetry_file = None
+        else:
+            self.params.telemetry_file = telemetry_file
+
     def write_params_to_panel( self ):   # write parameters to panel
 
         self.t_shape.SetValue( str(self.params.shape) )
         self.t_sigma.SetValue( str(self.params.sigma) )
         self.t_nepochs.SetValue( str(self.params.nepochs) )
         self.t_rate.SetValue( str(self.params.rate) )
+        self.t_batch_size.SetValue( str(self.params.batch_size) )
+        self.t_nworkers.SetValue( str(self.params.nworkers) )
+
+        self.t_sample_size.SetValue( str(self.params.sample_size) )
+        self.t_holdout_size.SetValue( str(self.params.holdout_size) )
+        self.t_check_interval.SetValue( str(self.params.check_interval) )
+        self.t_stop_threshold.SetValue( str(self.params.stop_threshold) )
+
+        self.c_warm_start.SetValue( self.params.warm_start )
+        self.t_warm_sigma_factor.SetValue( str(self.params.warm_sigma_factor) )
+        self.t_warm_rate_factor.SetValue( str(self.params.warm_rate_factor) )
+        self.t_warm_nepochs.SetValue( str(self.params.warm_nepochs) )
+
+        self.c_dedupe.SetValue( self.params.dedupe )
+        self.t_dedupe_step.SetValue( str(self.params.dedupe_step) )
+
+        if self.params.custom_initfile == None:
+            self.t_custom_initfile.SetValue( '' )
+        else:
+            self.t_custom_initfile.SetValue( self.params.custom_initfile )
 
         # neighborhood function
         if self.params.neighborhood_function == 'gaussian':
@@ -584,6 +1465,8 @@ class msom( op_panel ):
             self.r_random.SetValue( True )            
         if self.params.init_weights == 'pca':
             self.r_pca.SetValue( True )
+        if self.params.init_weights == 'custom':
+            self.r_custom.SetValue( True )
 
         # topology 
         if self.params.topology == 'rectangular':
@@ -598,8 +1481,8 @@ class msom( op_panel ):
             self.r_cosine.SetValue( True )
         if self.params.activation_distance == 'manhattan':
             self.r_manhattan.SetValue( True )
-        if self.params.activation_distance == 'chebysev':
-            self.r_chebysev.SetValue( True )
+        if self.params.activation_distance == 'chebyshev':
+            self.r_chebyshev.SetValue( True )
 
         # decay function
         if self.params.decay_function == 0:
@@ -637,6 +1520,11 @@ class msom( op_panel ):
         self.t_mapfile_prefix.SetValue( self.params.mapfile_prefix )
         self.t_actmapfile_prefix.SetValue( self.params.actmapfile_prefix )
 
+        if self.params.telemetry_file == None:
+            self.t_telemetry_file.SetValue( '' )
+        else:
+            self.t_telemetry_file.SetValue( self.params.telemetry_file )
+
         # initialize graphics
     def init_panel( self, benchtop ):
         op_panel.init_panel( self, benchtop ) # start with basics
@@ -680,6 +1568,30 @@ class msom( op_panel ):
 
         v_sizer.Add( h_sizer )
 
+        # training options
+        h_sizer = wx.BoxSizer( wx.HORIZONTAL )
+        panel = self.sampling_panel()
+        h_sizer.Add( panel, 0, wx.ALL, 1 )
+        panel = self.warm_panel()
+        h_sizer.Add( panel, 0, wx.ALL, 1 )
+        panel = self.dedupe_panel()
+        h_sizer.Add( panel, 0, wx.ALL, 1 )
+        v_sizer.Add( h_sizer )
+
+        h_sizer = wx.BoxSizer( wx.HORIZONTAL )
+        prompt = wx.StaticText( self.p_client, -1, 'enter init weights file:' )
+        h_sizer.Add( prompt, 0, wx.TOP, 5 )
+        self.t_custom_initfile = wx.TextCtrl( self.p_client, -1, "" )
+        self.t_custom_initfile.SetToolTip( 'enter .npz model or .labels report to start from' )
+        h_sizer.Add( self.t_custom_initfile, 1, wx.EXPAND, 0 )
+
+        prompt = wx.StaticText( self.p_client, -1, 'enter telemetry file:' )
+        h_sizer.Add( prompt, 0, wx.TOP, 5 )
+        self.t_telemetry_file = wx.TextCtrl( self.p_client, -1, "" )
+        self.t_telemetry_file.SetToolTip( 'append per epoch measurements as json lines, blank for none' )
+        h_sizer.Add( self.t_telemetry_file, 1, wx.EXPAND, 0 )
+        v_sizer.Add( h_sizer, 0, wx.EXPAND )
+
         h_sizer = wx.BoxSizer( wx.HORIZONTAL )
         prompt = wx.StaticText( self.p_client, -1, 'enter map pathname prefix:' )
         h_sizer.Add( prompt, 0, wx.TOP, 5 )
@@ -806,7 +1718,7 @@ class msom( op_panel ):
     def init_weights_panel( self ):
         p_init_weights = wx.Panel( self.p_client, -1, style=wx.SUNKEN_BORDER )
 
-        sizer = wx.GridSizer( 2, 2, 1, 1 )
+        sizer = wx.GridSizer( 3, 2, 1, 1 )
         prompt = wx.StaticText( p_init_weights, -1, 'init weights:' )
         sizer.Add( prompt )
         sizer.Add( (1,1) )
@@ -816,6 +1728,9 @@ class msom( op_panel ):
         sizer.Add( self.r_random )
         self.r_pca = wx.RadioButton( p_init_weights, -1, 'pca' )
         sizer.Add( self.r_pca )
+        self.r_custom = wx.RadioButton( p_init_weights, -1, 'custom' )
+        self.r_custom.SetToolTip( 'start from the weights in the init file' )
+        sizer.Add( self.r_custom )
 
         p_init_weights.SetSizer( sizer )
         
@@ -844,11 +1759,108 @@ class msom( op_panel ):
         
         return p_neigh
 
+    # stratified sample and holdout convergence checks
+    def sampling_panel( self ):
+        p_sample = wx.Panel( self.p_client, -1, style=wx.SUNKEN_BORDER )
+
+        sizer = wx.GridSizer( 5, 2, 1, 1 )
+        prompt = wx.StaticText( p_sample, -1, 'sampling:' )
+        sizer.Add( prompt )
+        sizer.Add( (1,1) )
+
+        prompt = wx.StaticText( p_sample, -1, 'sample size' )
+        sizer.Add( prompt, 1, wx.BOTTOM, 2 )
+        self.t_sample_size = wx.TextCtrl( p_sample, -1, size=(70,20),
+                                          style=wx.ALIGN_RIGHT )
+        self.t_sample_size.SetToolTip( 'train on a stratified sample of this many pixels, 0 for all' )
+        sizer.Add( self.t_sample_size, 1, wx.BOTTOM, 2 )
+
+        prompt = wx.StaticText( p_sample, -1, 'holdout size' )
+        sizer.Add( prompt, 1, wx.BOTTOM, 2 )
+        self.t_holdout_size = wx.TextCtrl( p_sample, -1, size=(70,20),
+                                           style=wx.ALIGN_RIGHT )
+        self.t_holdout_size.SetToolTip( 'pixels held out to check convergence, 0 for no checks' )
+        sizer.Add( self.t_holdout_size, 1, wx.BOTTOM, 2 )
+
+        prompt = wx.StaticText( p_sample, -1, 'check interval' )
+        sizer.Add( prompt, 1, wx.BOTTOM, 2 )
+        self.t_check_interval = wx.TextCtrl( p_sample, -1, size=(70,20),
+                                             style=wx.ALIGN_RIGHT )
+        self.t_check_interval.SetToolTip( 'training samples between holdout checks' )
+        sizer.Add( self.t_check_interval, 1, wx.BOTTOM, 2 )
+
+        prompt = wx.StaticText( p_sample, -1, 'stop threshold' )
+        sizer.Add( prompt, 1, wx.BOTTOM, 2 )
+        self.t_stop_threshold = wx.TextCtrl( p_sample, -1, size=(70,20),
+                                             style=wx.ALIGN_RIGHT )
+        self.t_stop_threshold.SetToolTip( 'stop when holdout QE improves by less than this fraction' )
+        sizer.Add( self.t_stop_threshold, 1, wx.BOTTOM, 2 )
+
+        p_sample.SetSizer( sizer )
+
+        return p_sample
+
+    # fine tune the init file weights with a short schedule
+    def warm_panel( self ):
+        p_warm = wx.Panel( self.p_client, -1, style=wx.SUNKEN_BORDER )
+
+        sizer = wx.GridSizer( 4, 2, 1, 1 )
+        self.c_warm_start = wx.CheckBox( p_warm, -1, 'warm start' )
+        self.c_warm_start.SetToolTip( 'fine tune the weights in the init file' )
+        sizer.Add( self.c_warm_start )
+        sizer.Add( (1,1) )
+
+        prompt = wx.StaticText( p_warm, -1, 'sigma factor' )
+        sizer.Add( prompt, 1, wx.BOTTOM, 2 )
+        self.t_warm_sigma_factor = wx.TextCtrl( p_warm, -1, size=(70,20),
+                                                style=wx.ALIGN_RIGHT )
+        self.t_warm_sigma_factor.SetToolTip( 'sigma is scaled by this when warm starting' )
+        sizer.Add( self.t_warm_sigma_factor, 1, wx.BOTTOM, 2 )
+
+        prompt = wx.StaticText( p_warm, -1, 'rate factor' )
+        sizer.Add( prompt, 1, wx.BOTTOM, 2 )
+        self.t_warm_rate_factor = wx.TextCtrl( p_warm, -1, size=(70,20),
+                                               style=wx.ALIGN_RIGHT )
+        self.t_warm_rate_factor.SetToolTip( 'learning rate is scaled by this when warm starting' )
+        sizer.Add( self.t_warm_rate_factor, 1, wx.BOTTOM, 2 )
+
+        prompt = wx.StaticText( p_warm, -1, 'nepochs' )
+        sizer.Add( prompt, 1, wx.BOTTOM, 2 )
+        self.t_warm_nepochs = wx.TextCtrl( p_warm, -1, size=(70,20),
+                                           style=wx.ALIGN_RIGHT )
+        self.t_warm_nepochs.SetToolTip( 'epochs when warm starting' )
+        sizer.Add( self.t_warm_nepochs, 1, wx.BOTTOM, 2 )
+
+        p_warm.SetSizer( sizer )
+
+        return p_warm
+
+    # train on unique pixel vectors weighted by their counts
+    def dedupe_panel( self ):
+        p_dedupe = wx.Panel( self.p_client, -1, style=wx.SUNKEN_BORDER )
+
+        sizer = wx.GridSizer( 2, 2, 1, 1 )
+        self.c_dedupe = wx.CheckBox( p_dedupe, -1, 'dedupe' )
+        self.c_dedupe.SetToolTip( 'train on unique pixels weighted by their counts' )
+        sizer.Add( self.c_dedupe )
+        sizer.Add( (1,1) )
+
+        prompt = wx.StaticText( p_dedupe, -1, 'step' )
+        sizer.Add( prompt, 1, wx.BOTTOM, 2 )
+        self.t_dedupe_step = wx.TextCtrl( p_dedupe, -1, size=(70,20),
+                                          style=wx.ALIGN_RIGHT )
+        self.t_dedupe_step.SetToolTip( 'round to multiples of this before comparing, 0 for exact duplicates' )
+        sizer.Add( self.t_dedupe_step, 1, wx.BOTTOM, 2 )
+
+        p_dedupe.SetSizer( sizer )
+
+        return p_dedupe
+
     def parms_panel( self ):
         p_parms = wx.Panel( self.p_client, -1,
                             style=wx.SUNKEN_BORDER )
         
-        sizer = wx.GridSizer( 5, 2, 1, 1 )
+        sizer = wx.GridSizer( 7, 2, 1, 1 )
         prompt = wx.StaticText( p_parms, -1, 'parms:' )
         sizer.Add( prompt )
         sizer.Add( (1,1) )
@@ -886,6 +1898,22 @@ class msom( op_panel ):
         self.t_rate.SetToolTip( 'enter learning rate' )
         sizer.Add( self.t_rate, 1, wx.BOTTOM, 2 )
 
+        # batch training
+        prompt = wx.StaticText( p_parms, -1, 'batch size' )
+        sizer.Add( prompt, 1, wx.BOTTOM, 2 )
+        self.t_batch_size = wx.TextCtrl( p_parms, -1, size=(70,20),
+                                         style=wx.ALIGN_RIGHT )
+        self.t_batch_size.SetToolTip( 'pixels per batch update, 0 for online training' )
+        sizer.Add( self.t_batch_size, 1, wx.BOTTOM, 2 )
+
+        # map evaluation threads
+        prompt = wx.StaticText( p_parms, -1, 'workers' )
+        sizer.Add( prompt, 1, wx.BOTTOM, 2 )
+        self.t_nworkers = wx.TextCtrl( p_parms, -1, size=(70,20),
+                                       style=wx.ALIGN_RIGHT )
+        self.t_nworkers.SetToolTip( 'threads evaluating the map, 0 for all cpus' )
+        sizer.Add( self.t_nworkers, 1, wx.BOTTOM, 2 )
+
         p_parms.SetSizer( sizer )
                                  
         return p_parms
@@ -899,13 +1927,64 @@ class msom( op_panel ):
         print( 'usage: msom.py', file=sys.stderr )
         print( '       -h, --help', file=sys.stderr )
         print( '       -p paramfile, --params=paramfile', file=sys.stderr )
+        print( '       -t files, --train=files', file=sys.stderr )
+        print( '       train on comma separated .npy files or patterns',
+               file=sys.stderr )
+        print( '       -u, --upstream', file=sys.stderr )
+        print( '       with -t, also read an upstream image to label',
+               file=sys.stderr )
+        print( '       -s sweepfile, --sweep=sweepfile', file=sys.stderr )
+        print( '       train parameter combinations, keep the best',
+               file=sys.stderr )
+        print( '       -n nworkers, --nworkers=nworkers', file=sys.stderr )
+        print( '       threads evaluating the map, 0 for all cpus',
+               file=sys.stderr )
+        print( '       --sample=size   train on a stratified sample, 0 for all',
+               file=sys.stderr )
+        print( '       --holdout=size   pixels held out to check convergence',
+               file=sys.stderr )
+        print( '       --check=interval   training samples between checks',
+               file=sys.stderr )
+        print( '       --stop=fraction   stop when holdout QE improves less',
+               file=sys.stderr )
+        print( '       -i initfile, --init=initfile', file=sys.stderr )
+        print( '       start from the weights of a .npz model or .labels report',
+               file=sys.stderr )
+        print( '       -w initfile, --warm=initfile', file=sys.stderr )
+        print( '       fine tune the weights of initfile with a short schedule',
+               file=sys.stderr )
+        print( '       --warm-sigma=factor, --warm-rate=factor, --warm-epochs=nepochs',
+               file=sys.stderr )
+        print( '       sigma and rate scaling and epochs when warm starting',
+               file=sys.stderr )
+        print( '       -d, --dedupe   train on unique pixels weighted by counts',
+               file=sys.stderr )
+        print( '       --dedupe-step=step   round to multiples of step first',
+               file=sys.stderr )
+        print( '       --telemetry=file   append per epoch measurements as json lines',
+               file=sys.stderr )
+        print( '       --progress=seconds   time between progress lines',
+               file=sys.stderr )
         print( '       input is stdin, output is stdout', file=sys.stderr )
 
     def set_params( self, argv ):
         params = None
+        training_files = None
+        sweep_file = None
+        nworkers = None
+        overrides = {}                # other parameters given here
+        self.upstream = False         # read stdin when training from files
 
         try:                                
-            opts, args = getopt.getopt( argv, 'hp:', ['help','params='] )
+            opts, args = getopt.getopt( argv, 'hp:t:s:un:i:w:d',
+                                        ['help','params=','train=','sweep=',
+                                         'upstream','nworkers=',
+                                         'sample=','holdout=','check=',
+                                         'stop=','init=','warm=',
+                                         'warm-sigma=','warm-rate=',
+                                         'warm-epochs=','dedupe',
+                                         'dedupe-step=','telemetry=',
+                                         'progress='] )
         except getopt.GetoptError:           
             self.usage()                          
             sys.exit(2)  
@@ -916,6 +1995,42 @@ class msom( op_panel ):
                 sys.exit(0) 
             elif opt in ('-p', '--params'):
                 params = arg  
+            elif opt in ('-t', '--train'):
+                training_files = arg.split( ',' )
+            elif opt in ('-s', '--sweep'):
+                sweep_file = arg
+            elif opt in ('-u', '--upstream'):
+                self.upstream = True
+            elif opt in ('-n', '--nworkers'):
+                nworkers = int( arg )
+            elif opt == '--sample':
+                overrides['sample_size'] = int( arg )
+            elif opt == '--holdout':
+                overrides['holdout_size'] = int( arg )
+            elif opt == '--check':
+                overrides['check_interval'] = int( arg )
+            elif opt == '--stop':
+                overrides['stop_threshold'] = float( arg )
+            elif opt in ('-i', '--init'):
+                overrides['init_weights'] = 'custom'
+                overrides['custom_initfile'] = arg
+            elif opt in ('-w', '--warm'):
+                overrides['warm_start'] = True
+                overrides['custom_initfile'] = arg
+            elif opt == '--warm-sigma':
+                overrides['warm_sigma_factor'] = float( arg )
+            elif opt == '--warm-rate':
+                overrides['warm_rate_factor'] = float( arg )
+            elif opt == '--warm-epochs':
+                overrides['warm_nepochs'] = int( arg )
+            elif opt in ('-d', '--dedupe'):
+                overrides['dedupe'] = True
+            elif opt == '--dedupe-step':
+                overrides['dedupe_step'] = float( arg )
+            elif opt == '--telemetry':
+                overrides['telemetry_file'] = arg
+            elif opt == '--progress':
+                overrides['progress_interval'] = float( arg )
 
         if params != None:
             ok = self.read_params_from_file( params )
@@ -925,27 +2040,31 @@ class msom( op_panel ):
 
                 sys.exit(2)
 
+        # command line files override the parameter file
+        if training_files != None:
+            self.params.training_files = training_files
+        if sweep_file != None:
+            self.params.sweep_file = sweep_file
+        if nworkers != None:
+            self.params.nworkers = nworkers
+        for name, value in overrides.items():
+            setattr( self.params, name, value )
+
 ####################################################################
 # command line user entry point 
 ####################################################################
 
 if __name__ == '__main__':
-    import tempfile
+    from poli_stream import read_stream, write_stream
     
     oper = instantiate()   
     oper.set_params( sys.argv[1:] )
 
-    # numpy needs to 'seek' in the file to load
-    # so read from stdin to temporary file first
-    temp_name = next(tempfile._get_candidate_names()) + '.tmp'
-    temp = open( temp_name, 'wb' )
-    temp.write( sys.stdin.buffer.read() )
-    temp.close()
-
-    # load the pickled data
-    oper.source = np.load( temp_name, allow_pickle=True,fix_imports=False)
-    os.remove( temp_name )
+    # training from files needs no upstream image unless asked
+    if len( oper.params.training_files ) == 0 or oper.upstream:
+        read_stream( oper )       # receive from upstream
 
     oper.run()                  
-    oper.sink.dump( sys.stdout.buffer )          # send down stream    
+    if isinstance( oper.sink, np.ndarray ):
+        write_stream( oper )      # send down stream    
     
@@ -26,15 +26,23 @@
 # Normalize all bands to either -1 to 1 or 0 to 1.
 # Optionally report scaling coefficients to file 
 # Optionally consider interlaced buffers for scaling
+# Optionally normalize a .npy file larger than memory to another
+# .npy file, a tile of rows at a time
+# Optionally fit one set of coefficients to many .npy files for cnorm
 
 norm_copyright = 'norm.py Copyright (c) 2010-2022 Scott L. Williams, released under GNU GPL V3.0'
 
 import wx
+import os
 import sys
+import glob
 import getopt
 import numpy as np
 
+from concurrent.futures import ProcessPoolExecutor
+
 from op_panel import op_panel
+from band_stats import band_stats, measure, coefficients, stretch
 
 # return an instance of 'norm' class 
 # without having to know its name
@@ -44,6 +52,29 @@ def instantiate():
 def get_name(): 
     return 'norm'
 
+# band count and band group statistics of one .npy file, computed
+# in a worker process. returns the file, band count, statistics and
+# an error message or None
+def measure_file( path, skip, tile_rows ):
+    oper = instantiate()
+    oper.params.skip = skip
+    oper.params.tile_rows = tile_rows
+
+    try:
+        image = np.load( path, mmap_mode='r' )
+    except ( IOError, ValueError ) as e:
+        return path, 0, None, str( e )
+
+    if image.ndim != 3:
+        return path, 0, None, 'expected a height,width,bands image'
+
+    nbands = image.shape[2]
+    groups = oper.band_groups( nbands )
+    if groups == None:
+        return path, nbands, None, 'skip does not divide the bands'
+
+    return path, nbands, oper.measure_tiles( image, groups ), None
+
 class norm_parameters():              # hold arguments values here
     def __init__( self ):
         self.ntype = 0                # 0 for 0 to 1; -1 for -1 to 1
@@ -51,6 +82,15 @@ class norm_parameters():              # hold arguments values here
         self.filepath = 'ncoeffs.txt' # coefficient output file
         self.skip = 0                 # interlace skip factor
 
+        self.infile = None            # .npy image to normalize out of core
+        self.outfile = None           # normalized .npy image written from infile
+        self.tile_rows = 256          # image rows read at a time from infile
+
+        self.fit_files = []           # .npy images, globs allowed, to fit one
+                                      # set of coefficients to; writes
+                                      # filepath only, no images
+        self.nworkers = 0             # fit processes, 0 for all cpus
+
 class norm( op_panel ):
     def __init__( self, name ):       # initialize op_panel but no graphics
         op_panel.__init__( self, name )
@@ -59,50 +99,28 @@ class norm( op_panel ):
         self.op_id = 'norm version 0.0'
         self.params = norm_parameters()
 
+    # min and max in one pass, ignoring nan; constant or
+    # infinite ranges make the image a surface plane
     def calc_coefficients( self, image, floor, ceiling ):
-
-        # workaround for bug in nanmin wrt unsigned ints
-        if image.dtype == np.uint8  \
-        or image.dtype == np.uint16 \
-        or image.dtype == np.uint32:
-            min = np.min( image )
-            max = np.max( image )
-        else:
-            min = np.nanmin( image )         # get values to scale by
-            max = np.nanmax( image )         # ignoring nan
-
-        if max == min :                # check for constant values
-            scale = 0.0 	       # make image a surface plane
-            c = 0.0
-
-        elif np.isinf( min ) or np.isinf( max ):
-            scale = 0.0 	       # make image a surface plane
-            c = 0.0
-
-        else:
-            scale = (ceiling-floor)/float((max-min)) 
-            c = floor-scale*min
-
-        return scale,c
+        return coefficients( measure( image ), floor, ceiling )
     
     # convert single band value range from floor to ceiling
-    def scale_band( self, band, image, floor, ceiling ):
+    # into the sink band
+    def scale_band( self, band, image, floor, ceiling, out ):
 
-        scale, c = self.calc_coefficients( image, floor, ceiling )
+        scale, c = stretch( image, measure( image ), floor, ceiling, out )
         
         # write out coeffs if asked to
         if ( self.cfile != None ):
             self.cfile.write( '%d,'%band + '%f,'%scale + '%f\n'%c )
-        
-        return image*scale + c
 
     # scale each band independently
     def no_interlace_scale( self ):
 
         nbands = self.source.shape[2]
         for i in range( nbands ):
-            self.sink[:,:,i] = self.scale_band( i, self.source[:,:,i],
-                                                self.params.ntype, 1.0 )
+            self.scale_band( i, self.source[:,:,i], self.params.ntype, 1.0,
+                             self.sink[:,:,i] )
     # scale interlaced bands together
     def interlace_scale( self ):
 
@@ -115,29 +133,165 @@ class norm( op_panel ):
             print( 'norm: skip factor does not evenly divide into number of bands', file=sys.stderr )
             return
 
-        # create appended buffers based on skips
-        cnum = int(nbands/skip)       # num of buffers to combine
-        
-        for i in range( skip ):  # skip = number of appended buffers 
+        for i in range( skip ):  # skip = number of interlaced groups
 
-            tmp = self.source[:,:,i] # initialize first buffer
+            # bands i, i+skip, i+2*skip,... as one strided view; no copy
+            group = self.source[:,:,i::skip]
 
-            # append remaining buffers
-            for j in range( 1, cnum ):
-                tmp = np.append( tmp, self.source[:,:,i+(skip*j)] )
-         
-            scale, c = self.calc_coefficients( tmp, self.params.ntype, 1.0 )
-            
-            # scale the interlaced buffers
-            for j in range( 0, cnum ):
-                index = i + (skip*j)
-                self.sink[:,:, index] = self.source[:,:,index]*scale + c
+            # scale the interlaced buffers straight into the sink
+            scale, c = stretch( group, measure( group ), self.params.ntype, 1.0,
+                                self.sink[:,:,i::skip] )
 
-                # write out coeffs if asked to
-                if ( self.cfile != None ):
+            # write out coeffs if asked to
+            if ( self.cfile != None ):
+                for index in range( i, nbands, skip ):
                     self.cfile.write( '%d,'%index + '%f,'%scale + '%f\n'%c )
 
         
+    # band slices scaled together: each band alone, or every skip'th
+    # band for interlaced buffers. None if skip does not divide nbands
+    def band_groups( self, nbands ):
+        skip = self.params.skip
+        if skip == 0:
+            return [ slice( i, i+1 ) for i in range( nbands ) ]
+
+        if nbands%skip != 0:
+            print( 'norm: skip factor does not evenly divide into number of bands', file=sys.stderr )
+            return None
+
+        return [ slice( i, None, skip ) for i in range( skip ) ]
+
+    # statistics of each band group of a (memory mapped) image, read
+    # a tile of rows at a time; stats, if given, are added to
+    def measure_tiles( self, image, groups, stats=None ):
+        if stats == None:
+            stats = [ band_stats() for g in groups ]
+
+        rows = max( 1, self.params.tile_rows )
+        for top in range( 0, image.shape[0], rows ):
+            tile = np.asarray( image[top:top+rows] )
+            for g, group in enumerate( groups ):
+                measure( tile[:,:,group], stats[g] )
+
+        return stats
+
+    # coefficient file for cnorm: a header of number of bands and
+    # normalization type, then a band,scale,offset line per band
+    def write_coefficients( self, nbands, groups, coeffs ):
+        try:
+            cfile = open( self.params.filepath, 'w' )
+            cfile.write( '%d,'%nbands+'%d\n'%self.params.ntype ) 
+
+            for group, (scale, c) in zip( groups, coeffs ):
+                for index in range( nbands )[group]:
+                    cfile.write( '%d,'%index + '%f,'%scale + '%f\n'%c )
+
+            cfile.close()
+
+        except IOError:
+            print( 'norm: cannot write', self.params.filepath, file=sys.stderr )
+
+    # normalize infile to outfile in two passes over row tiles: one
+    # for the statistics, one to scale. only a tile of each is in
+    # memory. returns false on failure
+    def run_files( self ):
+        try:
+            image = np.load( self.params.infile, mmap_mode='r' )
+        except ( IOError, ValueError ) as e:
+            print( 'norm:', e, file=sys.stderr )
+            return False
+
+        if image.ndim != 3:
+            print( 'norm: expected a height,width,bands image in',
+                   self.params.infile, file=sys.stderr )
+            return False
+
+        nbands = image.shape[2]
+        groups = self.band_groups( nbands )
+        if groups == None:
+            return False
+
+        stats = self.measure_tiles( image, groups )
+        coeffs = [ coefficients( st, self.params.ntype, 1.0 ) for st in stats ]
+
+        if self.params.write:
+            self.write_coefficients( nbands, groups, coeffs )
+
+        if self.params.outfile == None:
+            return True
+
+        try:
+            out = np.lib.format.open_memmap( self.params.outfile, mode='w+',
+                                             dtype=np.float32,
+                                             shape=image.shape )
+        except IOError as e:
+            print( 'norm:', e, file=sys.stderr )
+            return False
+
+        rows = max( 1, self.params.tile_rows )
+        for top in range( 0, image.shape[0], rows ):
+            tile = np.asarray( image[top:top+rows] )
+            for group, st in zip( groups, stats ):
+                stretch( tile[:,:,group], st, self.params.ntype, 1.0,
+                         out[top:top+rows,:,group] )
+
+        out.flush()
+        del out
+        return True
+
+    # coefficients fitted to all fit_files together, measured in
+    # parallel processes and merged; written to filepath for cnorm.
+    # returns false on failure
+    def run_fit( self ):
+        paths = []
+        for name in self.params.fit_files:
+            found = sorted( glob.glob( name ) )
+            if len( found ) == 0:
+                print( 'norm: no files match', name, file=sys.stderr )
+                return False
+            paths.extend( found )
+
+        nworkers = self.params.nworkers
+        if nworkers <= 0:
+            nworkers = os.cpu_count() or 1
+        nworkers = min( nworkers, len( paths ) )
+
+        print( 'norm: fitting', len( paths ), 'files on', nworkers,
+               'processes', file=sys.stderr, flush=True )
+
+        with ProcessPoolExecutor( max_workers=nworkers ) as pool:
+            results = list( pool.map( measure_file, paths,
+                                      [ self.params.skip ]*len( paths ),
+                                      [ self.params.tile_rows ]*len( paths ) ) )
+
+        nbands = None
+        merged = None
+        for path, fbands, stats, error in results:
+            if error != None:
+                print( 'norm: %s: %s'%(path, error), file=sys.stderr )
+                return False
+
+            if nbands == None:
+                nbands = fbands
+                merged = stats
+            elif fbands != nbands:
+                print( 'norm: band count of', path, 'does not match',
+                       file=sys.stderr )
+                return False
+            else:
+                for total, st in zip( merged, stats ):
+                    total.merge( st )
+
+        groups = self.band_groups( nbands )
+        for g, st in enumerate( merged ):
+            print( 'norm: group %d min= %g max= %g nan= %d of %d'%
+                   (g, st.min, st.max, st.nnan, st.count), file=sys.stderr )
+
+        coeffs = [ coefficients( st, self.params.ntype, 1.0 ) for st in merged ]
+        self.write_coefficients( nbands, groups, coeffs )
+
+        return True
+
     def run( self ):                 # override superclass 
 
         # create the output buffer to populate with scaled values
@@ -329,15 +483,29 @@ class norm( op_panel ):
         print( '       -f coeff_file --file=coeff_file', file=sys.stderr )
         print( '       -t [0,-1], --type=[0,-1]',file=sys.stderr )
         print( '       -s skip_factor, --skip=skip_factor', file=sys.stderr )
+        print( '       -i infile.npy, --infile=infile.npy', file=sys.stderr )
+        print( '       -o outfile.npy, --outfile=outfile.npy', file=sys.stderr )
+        print( '              normalize infile to outfile out of core',
+               file=sys.stderr )
+        print( '       -r tile_rows, --rows=tile_rows', file=sys.stderr )
+        print( '       -m files, --fit=files', file=sys.stderr )
+        print( '              fit one coefficient file (-f) to comma separated',
+               file=sys.stderr )
+        print( '              .npy files or patterns; no images are written',
+               file=sys.stderr )
+        print( '       -w nworkers, --workers=nworkers', file=sys.stderr )
         print( '       -p param_file, --params=param_file', file=sys.stderr )
-        print( '       input is stdin, output is stdout', file=sys.stderr )
+        print( '       input is stdin, output is stdout unless -i is given',
+               file=sys.stderr )
 
     def set_params( self, argv ):
         params = None
         
         try:                                
-            opts, args = getopt.getopt( argv, 'hf:t:p:',
-                                        ['help','file=','type=','param='] )
+            opts, args = getopt.getopt( argv, 'hf:t:s:i:o:r:m:w:p:',
+                                        ['help','file=','type=','skip=',
+                                         'infile=','outfile=','rows=',
+                                         'fit=','workers=','param='] )
             
         except getopt.GetoptError:           
             self.usage()                          
@@ -354,6 +522,16 @@ class norm( op_panel ):
                 self.params.ntype = int(arg)
             elif opt in ( '-s', '--skip' ):
                 self.params.skip = int(arg)
+            elif opt in ( '-i', '--infile' ):
+                self.params.infile = arg
+            elif opt in ( '-o', '--outfile' ):
+                self.params.outfile = arg
+            elif opt in ( '-r', '--rows' ):
+                self.params.tile_rows = int(arg)
+            elif opt in ( '-m', '--fit' ):
+                self.params.fit_files = arg.split( ',' )
+            elif opt in ( '-w', '--workers' ):
+                self.params.nworkers = int(arg)
             elif opt in ('-p', '--params'):
                 params = arg  
 
@@ -369,22 +547,22 @@ class norm( op_panel ):
 ####################################################################
 
 if __name__ == '__main__':
-    import os
-    import tempfile
+    from poli_stream import read_stream, write_stream
 
     oper = instantiate()   
     oper.set_params( sys.argv[1:] )
 
-    # numpy needs to 'seek' in the file to load
-    # so read from stdin to temporary file first
-    temp_name = next(tempfile._get_candidate_names()) + '.tmp'
-    temp = open( temp_name, 'wb' )
-    temp.write( sys.stdin.buffer.read() )
-    temp.close()
+    # coefficients only
+    if len( oper.params.fit_files ) > 0:
+        ok = oper.run_fit()
+        sys.exit( 0 if ok else 1 )
+
+    # file to file; no stream
+    if oper.params.infile != None:
+        ok = oper.run_files()
+        sys.exit( 0 if ok else 1 )
 
-    # load the pickled data
-    oper.source = np.load( temp_name, allow_pickle=True,fix_imports=False)
-    os.remove( temp_name )
+    read_stream( oper )           # receive from upstream
 
     oper.run()                  
-    oper.sink.dump( sys.stdout.buffer )          # send downstream    
+    write_stream( oper )          # send downstream    
@@ -36,6 +36,9 @@
 
 # example wrf_source input string for for averaging 10:00-11:00hrs :
 # TSK:10,EMISS:10,SWDOWN:10,GLW:10,GRDFLX:10,T2:10,PSFC:10,Q2:10,U10:10,V10:10,TSK:11,EMISS:11,SWDOWN:11,GLW:11,GRDFLX:11,T2:11,PSFC:11,Q2:11,U10:11,V10:11
+
+# example wrf_source input string for all hours of a day in one cube :
+# TSK:0-23,EMISS:0-23,SWDOWN:0-23,GLW:0-23,GRDFLX:0-23,T2:0-23,PSFC:0-23,Q2:0-23,U10:0-23,V10:0-23
    
 prep_eto_copyright = 'prep_eto.py Copyright (c) 2016-2022 Scott L. Williams, released under GNU GPL V3.0'
 
@@ -220,7 +223,7 @@ class prep_eto( op_panel ):
             print( 'wrong data type, should be float32', file=sys.stderr )
             sys.exit( 2 )
 
-        numy,numx,nbands = source.shape # get dimensions
+        # works on a (y,x,band) image or a (time,y,x,band) cube
 
         # input bands:
         # TSK        surface skin temperature (K)                band 0
@@ -245,60 +248,60 @@ class prep_eto( op_panel ):
         # w2  - average hourly wind speed at 2m, m/s
 
         # allocate output space; has 8 bands
-        sink = np.empty( (numy,numx,8), dtype=np.float32 )
+        sink = np.empty( source.shape[:-1] + (8,), dtype=np.float32 )
 
         # pass through skin temperature and emissivity values
-        tsk = source[:,:,0]
-        emiss = source[:,:,1]
+        tsk = source[...,0]
+        emiss = source[...,1]
         
         # pass through short and long radiation time slice, W/m^2
-        Rsd = source[:,:,2]
-        Rld = source[:,:,3]
+        Rsd = source[...,2]
+        Rld = source[...,3]
 
         # calculate net radiation, returns MJ/(m^2*hr)
-        sink[:,:,0] = self.calc_Rn( Rsd, Rld, tsk, emiss, self.params.albedo )
+        sink[...,0] = self.calc_Rn( Rsd, Rld, tsk, emiss, self.params.albedo )
 
         # convert the ground flux
-        G = source[:,:,4]
-        sink[:,:,1] = G/(10**6) * 3600  # convert (J/s)/m^2 to  MJ/(m^2*hr)
+        G = source[...,4]
+        sink[...,1] = G/(10**6) * 3600  # convert (J/s)/m^2 to  MJ/(m^2*hr)
         
         # convert temps (K) to (C)
-        Thk = source[:,:,5]
-        sink[:,:,2] = Thk - 273.16 # make Celsius 
+        Thk = source[...,5]
+        sink[...,2] = Thk - 273.16 # make Celsius 
 
         # calculate D, saturation slope vapor pressure curve 
-        sink[:,:,3] = self.calc_D( sink[:,:,2] )
+        sink[...,3] = self.calc_D( sink[...,2] )
 
         # calculate g psychrometric, kPa/C, from surface pressure
-        P = source[:,:,6]
-        sink[:,:,4] = self.calc_g( P )
+        P = source[...,6]
+        sink[...,4] = self.calc_g( P )
 
         # es, saturation vapor pressure at Thc
-        sink[:,:,5] = self.calc_es( sink[:,:,2] )
+        sink[...,5] = self.calc_es( sink[...,2] )
 
         # calculate relative humidity
-        Q2 = source[:,:,7]
+        Q2 = source[...,7]
         Rh = self.calc_Rh( Q2, Thk, P )
             
         # ea, actual vapor pressure, ea = es*Rh
-        sink[:,:,6] = sink[:,:,5] * Rh
+        sink[...,6] = sink[...,5] * Rh
 
         # calculate wind speed
         # convert from 10m to 2m speed; m/s
 
-        U2 = self.convert_wind( source[:,:,8], 10.0 )
-        V2 = self.convert_wind( source[:,:,9], 10.0 )
-        sink[:,:,7] = np.sqrt( U2*U2 + V2*V2 )
+        U2 = self.convert_wind( source[...,8], 10.0 )
+        V2 = self.convert_wind( source[...,9], 10.0 )
+        sink[...,7] = np.sqrt( U2*U2 + V2*V2 )
 
         # TODO: incorporate W10 (vertical wind speed)
         #       how to convert from 10m to 2m ?
-        #sink[:,:,7] = np.sqrt( U2*U2 + V2*V2 + W2*w2 )
+        #sink[...,7] = np.sqrt( U2*U2 + V2*V2 + W2*w2 )
 
         return sink
 
     def run( self ):            # override superclass run
 
-        height,width,nbands = self.source.shape
+        nbands = self.source.shape[-1]  # hours of a time cube go together
 
         if nbands == 10:
             self.sink = self.prep_eto( self.source )
@@ -306,8 +309,8 @@ class prep_eto( op_panel ):
         elif nbands == 20:
 
             # average the preps
-            tmp1 = self.prep_eto( self.source[:,:,:10] )
-            tmp2 = self.prep_eto( self.source[:,:,10:20] )
+            tmp1 = self.prep_eto( self.source[...,:10] )
+            tmp2 = self.prep_eto( self.source[...,10:20] )
             self.sink = (tmp1+tmp2)/2.0
             
         else:
@@ -403,22 +406,12 @@ class prep_eto( op_panel ):
 ####################################################################
 
 if __name__ == '__main__':
-    import os
-    import tempfile
+    from poli_stream import read_stream, write_stream
 
     oper = instantiate()
     oper.set_params( sys.argv[1:] )
 
-    # numpy needs to 'seek' in the file to load
-    # so read from stdin to temporary file first
-    temp_name = next(tempfile._get_candidate_names()) + '.tmp'
-    temp = open( temp_name, 'wb' )
-    temp.write( sys.stdin.buffer.read() )
-    temp.close()
-
-    # load the pickled data
-    oper.source = np.load( temp_name, allow_pickle=True,fix_imports=False)
-    os.remove( temp_name )
+    read_stream( oper )           # receive from upstream
  
     oper.run()                  
-    oper.sink.dump( sys.stdout.buffer )          # send downstream    
+    write_stream( oper )          # send downstream    
@@ -34,6 +34,7 @@ import getopt
 import numpy as np
 
 from op_panel import op_panel
+from band_stats import measure, stretch
 from PIL import Image	
 
 # return an instance of 'render' class 
@@ -66,22 +67,12 @@ class render( op_panel ):
     # convert single-banded image to byte datatype for display
     def recast_band( self, image ):
 
-        # check for constant values
-        min = np.nanmin(image)         # get values to scale
-        max = np.nanmax(image)         # ignoring nan
-
-        if max == min : 
-            scale = 0.0 	       # make blank image
-            c = 0.0
-        else:
-            scale = 255.0/(max-min)    # stretch to 8-bit range
-            c = -scale*min
-
+        # stretch to 8-bit range; constant values make a blank image
         # supply our own resultant array of byte type
         height,width = image.shape
         b_image = np.empty( (height,width), dtype=np.uint8 )
 
-        b_image = (image*scale + c).astype(np.uint8)
+        stretch( image, measure( image ), 0.0, 255.0, b_image )
         return b_image
 
     def prep( self ):
@@ -237,7 +228,7 @@ class render( op_panel ):
                 self.params.grey = None
 
             elif opt in ( '-f', '--file' ):
-                oper.params.filepath = arg
+                self.params.filepath = arg
             
             elif opt in ( '-p', '--params' ):
                 params = arg  
@@ -259,20 +250,10 @@ class render( op_panel ):
 ####################################################################
 
 if __name__ == '__main__':
-    import os
-    import tempfile
+    from poli_stream import read_stream
     
     oper = instantiate()      
     oper.set_params( sys.argv[1:] )
 
-    # numpy needs to 'seek' on the file to load
-    # so read from stdin to temporary file first
-    temp_name = next(tempfile._get_candidate_names()) + '.tmp'
-    temp = open( temp_name, 'wb' )
-    temp.write( sys.stdin.buffer.read() )
-    temp.close()
-
-    # load the pickled data
-    oper.source = np.load( temp_name, allow_pickle=True,fix_imports=False)
-    os.remove( temp_name )
+    read_stream( oper )           # receive from upstream
     oper.run()                  
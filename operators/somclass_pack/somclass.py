@@ -30,12 +30,20 @@
 somclass_copyright = 'somclass.py Copyright (c) 2010-2022 Scott L. Williams, released under GNU GPL V3.0'
 
 import wx
+import os
 import sys
+import glob
+import time
 import getopt
 import numpy as np
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 from op_panel import op_panel
 
+import som_engine
+from som_model import read_model, read_report, is_model_file
+
 # return an instance of 'somclass' class 
 # without having to know its name
 def instantiate():	
@@ -46,8 +54,16 @@ def get_name():
 
 class somclass_parameters():              # hold arguments values here
     def __init__( self ):
-        self.weightfile = 'som_weights.label'
+        self.weightfile = 'som_weights.label'   # .labels report or .npz model
         self.nclasses = 16
+        self.mmap = False                       # memory map .npz model weights
+        self.use_index = True                   # kd-tree search for large maps
+
+        self.batch_files = []                   # .npy images to classify to
+                                                # label files, globs allowed
+        self.batch_outdir = None                # label file directory, None
+                                                # for beside each input
+        self.nworkers = 0                       # batch threads, 0 for all cpus
         
 class somclass( op_panel ):
     def __init__( self, name ):      # initialize op_panel but no graphics
@@ -55,99 +71,186 @@ class somclass( op_panel ):
         self.op_id = 'somclass version 0.0'
         self.params = somclass_parameters()
 
-    # match image sample to closest map weights
-    def classify( self, neurons, image ):
-        num_neurons,nnbands = neurons.shape
-        height,width,nbands = image.shape
+        self.index = None            # kd-tree over the neurons in use
+        self.index_key = None        # weight file, its time, nclasses
 
-        if nnbands != nbands:
-            print('somclass: dimensions do not match',
-                  nnbands, nbands, file=sys.stderr )
+    # kd-tree over the neurons, built once per weight set; None
+    # when brute force search is faster
+    def get_index( self, neurons, metric ):
+        if not self.params.use_index:
             return None
 
-        # set up arrays
-        min = np.empty( (height,width,1), dtype=np.float32 )
-        new = np.empty( (height,width,1), dtype=np.float32 )
+        try:
+            mtime = os.path.getmtime( self.params.weightfile )
+        except OSError:
+            mtime = None
 
-        # initialize to the zeroth neuron
-        classified = np.zeros( (height,width,1), dtype=np.uint8 )
+        key = ( self.params.weightfile, mtime, len( neurons ), metric )
+        if key != self.index_key:
+            self.index = som_engine.build_index( neurons, metric )
+            self.index_key = key
 
-        diff = image-neurons[0]        # initialize min array
-        diff = np.abs( diff )          # using no-square euclid metric
-        min = np.sum( diff, axis=2 )   # TODO: determine metric and use
+        return self.index
 
-        for i in range( 1,num_neurons ):    # test each neuron.
-            diff = image-neurons[i]         # keep track of minimal distances
-            diff = np.abs( diff )           # and compare/adjust with each 
-            new = np.sum( diff, axis=2 )    # new distance array
+    # match image sample to closest map weights
+    def classify( self, neurons, image, metric='euclidean' ):
+        return som_engine.classify( neurons, image, metric,
+                                    index=self.get_index( neurons, metric ) )
+
+    # number of classes to use given the number available
+    def use_nclasses( self, nneurons ):
+        nclasses = self.params.nclasses
+
+        if nclasses <= 0:
+            nclasses = nneurons # read all classes
+            warn = '\tsomclass: reading all classes, nclasses= : ' + str(nneurons) + '\n'
+        else:
+            if nclasses > nneurons:
+                warn = '\tsomclass: nclasses given is greater than available classes.\n\tsomclass: using all available classes. \n\tnclasses= ' + str(nneurons) + '\n'
+                print( warn, file=sys.stderr )
+                nclasses = nneurons
+            else:
+                warn = '\tsomclass: using ' + str(nclasses) + ' classes' + '\n'
+
+        print( warn, file=sys.stderr )
+        return nclasses
+
+    # neurons to classify with and the distance they were trained
+    # with, from a binary model or a .labels report of msom.
+    # None on failure
+    def read_neurons( self ):
+        if is_model_file( self.params.weightfile ):
+            model = read_model( self.params.weightfile, self.params.mmap )
+        else:
+            model = read_report( self.params.weightfile, sys.stderr )
+
+        if model == None:
+            return None
 
-            mask = min > new
+        neurons = model.neurons()
 
-            np.putmask( min, mask, new )      # use same mask to
-            np.putmask( classified, mask, i ) # keep track of class
+        # see if user request for nclasses works
+        nclasses = self.use_nclasses( len( neurons ) )
 
-        return classified
+        return neurons[:nclasses], model.metric()
 
     def run( self ):                        # override superclass run      
-        try:                                # read neuron weights
-
-            # get number of classes to read
-            nclasses = self.params.nclasses
-            wfile = open( self.params.weightfile, 'r' ) 
-
-            # print header and look for flag
-            found = False
-            for line in wfile:
-                if line.find( 'NEURONS' ) != -1:
-                    found = True
-                    break
-                print( line.strip(), file=sys.stderr )
-                
-            if not found:
-                print( 'somclass:run:could not find flag', file=sys.stderr )
-                return
-                
-            nneurons,ndim = wfile.readline().split()
-            nneurons = int( nneurons )
-            ndim = int( ndim )
-
-            # see if user request for nclasses works
-            if nclasses <= 0:
-                nclasses = nneurons # read all classes
-                warn = '\tsomclass: reading all classes, nclasses= : ' + str(nneurons) + '\n'
-            else:
-                if nclasses > nneurons:
-                    warn = '\tsomclass: nclasses given is greater than available classes.\n\tsomclass: using all available classes. \n\tnclasses= ' + str(nneurons) + '\n'
-                    print( warn, file=sys.stderr )
-                    nclasses = nneurons
-                else:
-                    warn = '\tsomclass: using ' + str(nclasses) + ' classes' + '\n'
-
-            print( warn, file=sys.stderr )
-            
-            # get the neuron weights
-            neurons = np.empty( (nclasses,ndim), dtype=np.float32 )
-
-            # retrieve neurons from file
-            for i in range( nclasses ):            
-                line = wfile.readline().split()    # get line components:
-                                                   # label weight[0], weight[1],..., number of pixels
-                for j in range( 1, ndim+1 ):       # skip grey level label
-                    neurons[i,j-1] = float( line[j] )
-            
-            wfile.close()
-
-        except IOError:
-            self.messages.append( '\tsomclass:run: IOError\n' )
+        result = self.read_neurons()
+        if result == None:
+            print( 'somclass:run: cannot read weights', file=sys.stderr )
             return
 
-        self.sink = self.classify( neurons, self.source )
+        neurons, metric = result
+        self.sink = self.classify( neurons, self.source, metric )
 
         # rebranding band here is more convenient than 
         # overriding apply_work()
         self.band_tags = []
         self.band_tags.append( 'som map' )
 
+    # label image file written for an input file
+    def batch_outfile( self, infile ):
+        outdir = self.params.batch_outdir
+        if outdir == None:
+            outdir = os.path.dirname( infile )
+
+        stem = os.path.splitext( os.path.basename( infile ) )[0]
+        return os.path.join( outdir, stem + '_labels.npy' )
+
+    # classify one memory mapped .npy image (Y,X,band or T,Y,X,band)
+    # and save its label image. returns the input file, pixel count,
+    # seconds and output file, or an error message for the file
+    def classify_file( self, infile, neurons, metric, index ):
+        start = time.perf_counter()
+
+        # a bad file fails alone, not the batch
+        try:
+            image = np.load( infile, mmap_mode='r' )
+
+            if image.ndim < 3 or image.shape[-1] != neurons.shape[1]:
+                return infile, 0, 0.0, None, 'shape %s does not match %i bands'% \
+                    ( image.shape, neurons.shape[1] )
+
+            # stack leading axes as rows
+            rows = image.reshape( (-1,) + image.shape[-2:] )
+            labels = som_engine.classify( neurons, rows, metric, index=index )
+            if labels is None:
+                return infile, 0, 0.0, None, 'cannot classify'
+            labels = labels.reshape( image.shape[:-1] + (1,) )
+
+            outfile = self.batch_outfile( infile )
+            np.save( outfile, labels )
+
+        except Exception as e:
+            return infile, 0, 0.0, None, str( e ) or type( e ).__name__
+
+        npix = labels.size
+        return infile, npix, time.perf_counter() - start, outfile, None
+
+    # classify every batch file with one loaded model, a file per
+    # worker thread at a time. the workers share the neurons and
+    # kd-tree; numpy and the tree search release the interpreter
+    # lock, so files are classified in parallel
+    def run_batch( self ):
+        infiles = []
+        for name in self.params.batch_files:
+            found = sorted( glob.glob( name ) )
+            if len( found ) == 0:
+                print( 'somclass: no files match', name, file=sys.stderr )
+            infiles.extend( found )
+
+        if len( infiles ) == 0:
+            return False
+
+        result = self.read_neurons()
+        if result == None:
+            return False
+        neurons, metric = result
+
+        nworkers = self.params.nworkers
+        if nworkers <= 0:
+            nworkers = os.cpu_count() or 1
+        nworkers = min( nworkers, len( infiles ) )
+
+        # files, not the tree search, are spread over the cpus
+        index = self.get_index( neurons, metric )
+        if index != None:
+            index.nworkers = 1 if nworkers > 1 else 0
+
+        if self.params.batch_outdir != None:
+            os.makedirs( self.params.batch_outdir, exist_ok=True )
+
+        print( 'somclass: classifying', len( infiles ), 'files on', nworkers,
+               'threads', file=sys.stderr, flush=True )
+
+        start = time.perf_counter()
+        failed = 0
+        total = 0
+        with ThreadPoolExecutor( max_workers=nworkers ) as pool:
+            futures = [ pool.submit( self.classify_file, infile, neurons,
+                                     metric, index )
+                        for infile in infiles ]
+
+            for future in as_completed( futures ):
+                infile, npix, seconds, outfile, error = future.result()
+                if error != None:
+                    print( 'somclass: %s: %s'%(infile, error), file=sys.stderr,
+                           flush=True )
+                    failed += 1
+                    continue
+
+                total += npix
+                print( '%s %10i pixels %8.3f s %12.0f pixels/s -> %s'%
+                       (infile, npix, seconds, npix/max( seconds, 1e-9 ), outfile),
+                       file=sys.stderr, flush=True )
+
+        seconds = time.perf_counter() - start
+        print( 'somclass: %i files, %i pixels in %.3f s, %.0f pixels/s, %i failed'%
+               (len( infiles ) - failed, total, seconds,
+                total/max( seconds, 1e-9 ), failed), file=sys.stderr, flush=True )
+
+        return failed == 0
+
     ####################################################################
     # gui section
     ####################################################################
@@ -186,7 +289,7 @@ class somclass( op_panel ):
         h_sizer.Add( prompt, 0, wx.TOP, 5 )
 
         self.t_weightfile = wx.TextCtrl( self.p_client, -1 ) 
-        self.t_weightfile.SetToolTip( ' enter filename to read weights from' )
+        self.t_weightfile.SetToolTip( ' enter filename to read weights from (.labels or .npz)' )
         h_sizer.Add( self.t_weightfile, 1, wx.EXPAND )
 
         v_sizer.Add( h_sizer, 1, wx.EXPAND )
@@ -204,16 +307,33 @@ class somclass( op_panel ):
         print( '       -f weights, --file=weights', file=sys.stderr )
         print( '       -n num_weights_to_use, --num=num_weights_to_use',
                file=sys.stderr )
+        print( '       -m, --mmap   memory map .npz model weights',
+               file=sys.stderr )
+        print( '       -b, --brute  no kd-tree search for large maps',
+               file=sys.stderr )
+        print( '       -i files, --inputs=files   classify comma separated .npy',
+               file=sys.stderr )
+        print( '              files or patterns to <name>_labels.npy files',
+               file=sys.stderr )
+        print( '       -o outdir, --outdir=outdir   directory for label files',
+               file=sys.stderr )
+        print( '       -w nworkers, --workers=nworkers', file=sys.stderr )
         print( '       -p param_file, --params=param_file', file=sys.stderr )
-        print( '       input is stdin, output is stdout', file=sys.stderr )
+        print( '       input is stdin, output is stdout unless -i is given',
+               file=sys.stderr )
 
     def set_params( self, argv ):
         params = None
+        batch_files = None
+        batch_outdir = None
+        nworkers = None
 
         try:                                
             opts, args = getopt.getopt( argv, 
-                                        'hp:f:n:', 
-                                        ['help','param=','file=','nclasses='] )
+                                        'hp:f:n:mbi:o:w:', 
+                                        ['help','param=','file=','nclasses=',
+                                         'mmap','brute','inputs=','outdir=',
+                                         'workers='] )
         except getopt.GetoptError:           
             self.usage()                          
             sys.exit(2)  
@@ -226,6 +346,16 @@ class somclass( op_panel ):
                 self.params.weightfile = arg
             elif opt in ( '-n', '--nclasses' ):
                 self.params.nclasses = int(arg)
+            elif opt in ( '-m', '--mmap' ):
+                self.params.mmap = True
+            elif opt in ( '-b', '--brute' ):
+                self.params.use_index = False
+            elif opt in ( '-i', '--inputs' ):
+                batch_files = arg.split( ',' )
+            elif opt in ( '-o', '--outdir' ):
+                batch_outdir = arg
+            elif opt in ( '-w', '--workers' ):
+                nworkers = int( arg )
             elif opt in ('-p', '--params'):
                 params = arg  
 
@@ -235,27 +365,30 @@ class somclass( op_panel ):
                 print( "somclass.py: cannot read parameter file", file=sys.stderr)
                 sys.exit(2)
 
+        # batch options take precedence over the parameter file
+        if batch_files != None:
+            self.params.batch_files = batch_files
+        if batch_outdir != None:
+            self.params.batch_outdir = batch_outdir
+        if nworkers != None:
+            self.params.nworkers = nworkers
+
 ####################################################################
 # command line user entry point 
 ####################################################################
 
 if __name__ == '__main__':
-    import os
-    import tempfile
+    from poli_stream import read_stream, write_stream
 
     oper = instantiate()   
     oper.set_params( sys.argv[1:] )
 
-    # numpy needs to seek on the file to load
-    # so read from stdin to temporary file first
-    temp_name = next(tempfile._get_candidate_names()) + '.tmp'
-    temp = open( temp_name, 'wb' )
-    temp.write( sys.stdin.buffer.read() )
-    temp.close()
+    # label files are written directly; no stream
+    if len( oper.params.batch_files ) > 0:
+        ok = oper.run_batch()
+        sys.exit( 0 if ok else 1 )
 
-    # load the pickled data
-    oper.source = np.load( temp_name, allow_pickle=True,fix_imports=False)
-    os.remove( temp_name )
+    read_stream( oper )           # receive from upstream
  
     oper.run()                  
-    oper.sink.dump( sys.stdout.buffer )          # send downstream    
+    write_stream( oper )          # send downstream    
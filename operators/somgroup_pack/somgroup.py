@@ -0,0 +1,301 @@
+#! /usr/bin/env /usr/bin/python3
+
+'''
+@file somgroup.py
+@author Scott L. Williams
+@package POLI
+@brief Merge SOM classes of a label image into fewer groups.
+@LICENSE
+#
+#  Copyright (C) 2010-2022 Scott L. Williams.
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+'''
+
+# merge the neuron classes of an msom or somclass label image into
+# fewer groups. the neuron weights are clustered hierarchically and
+# each label is looked up in the resulting table; no pixel is
+# compared with a neuron again.
+
+somgroup_copyright = 'somgroup.py Copyright (c) 2010-2022 Scott L. Williams, released under GNU GPL V3.0'
+
+import wx
+import os
+import sys
+import getopt
+import numpy as np
+
+from scipy.cluster.hierarchy import linkage, fcluster
+
+from op_panel import op_panel
+
+import som_engine
+from som_model import read_model, read_report, is_model_file
+
+# return an instance of 'somgroup' class
+# without having to know its name
+def instantiate():
+    return somgroup( get_name() )
+
+def get_name():
+    return 'somgroup'
+
+# hierarchical linkage methods
+METHODS = ( 'ward', 'average', 'complete', 'single' )
+
+class somgroup_parameters():              # hold arguments values here
+    def __init__( self ):
+        self.weightfile = 'msom_weights.npz'    # .npz model or .labels report
+                                                # the labels came from
+        self.nclasses = 8                       # number of groups
+        self.method = 'ward'                    # linkage method
+        self.lutfile = None                     # write label to group table
+
+class somgroup( op_panel ):
+    def __init__( self, name ):      # initialize op_panel but no graphics
+        op_panel.__init__( self, name )
+        self.op_id = 'somgroup version 0.0'
+        self.params = somgroup_parameters()
+
+        # not self.lut, which op_panel uses for the display palette
+        self.group_lut = None        # label to group lookup table
+        self.group_lut_key = None    # weight file, its time, nclasses, method
+
+    # read the neurons and the distance they were trained with
+    def read_neurons( self ):
+        if is_model_file( self.params.weightfile ):
+            model = read_model( self.params.weightfile )
+        else:
+            model = read_report( self.params.weightfile )
+
+        if model == None:
+            return None, None
+
+        return model.neurons(), model.metric()
+
+    # cluster the neurons into nclasses groups; returns the group of
+    # each neuron label, groups numbered by their lowest label
+    def group_neurons( self, neurons, metric ):
+        nneurons = len( neurons )
+        nclasses = self.params.nclasses
+
+        if nclasses <= 0 or nclasses >= nneurons:
+            print( 'somgroup: keeping all', nneurons, 'classes', file=sys.stderr )
+            return np.arange( nneurons )
+
+        if self.params.method not in METHODS:
+            print( 'somgroup: unknown linkage method:', self.params.method,
+                   file=sys.stderr )
+            return None
+
+        # angles matter for cosine maps, not lengths
+        neurons = np.asarray( neurons, dtype=np.float64 )
+        if metric == 'cosine':
+            neurons = neurons/( np.linalg.norm( neurons, axis=1 )[:,np.newaxis] + 1e-8 )
+
+        tree = linkage( neurons, method=self.params.method )
+        groups = fcluster( tree, nclasses, criterion='maxclust' )
+
+        # number groups in order of their first neuron
+        first = np.unique( groups, return_index=True )[1]
+        order = np.empty( groups.max()+1, dtype=np.intp )
+        order[groups[np.sort( first )]] = np.arange( len( first ) )
+
+        return order[groups]
+
+    # lookup table for the current parameters, rebuilt only when
+    # they or the weight file change
+    def get_lut( self ):
+        try:
+            mtime = os.path.getmtime( self.params.weightfile )
+        except OSError as e:
+            print( 'somgroup:', e, file=sys.stderr )
+            return None
+
+        key = ( self.params.weightfile, mtime, self.params.nclasses,
+                self.params.method )
+        if key == self.group_lut_key:
+            return self.group_lut
+
+        neurons, metric = self.read_neurons()
+        if neurons is None:
+            return None
+
+        groups = self.group_neurons( neurons, metric )
+        if groups is None:
+            return None
+
+        self.group_lut = groups.astype( som_engine.label_dtype( groups.max()+1 ) )
+        self.group_lut_key = key
+
+        if self.params.lutfile != None:
+            self.write_lut()
+
+        return self.group_lut
+
+    # label and group, one neuron per line
+    def write_lut( self ):
+        try:
+            np.savetxt( self.params.lutfile,
+                        np.column_stack( ( np.arange( len( self.group_lut ) ),
+                                           self.group_lut ) ),
+                        fmt='%i', header='label group' )
+        except IOError:
+            print( 'somgroup: cannot write', self.params.lutfile, file=sys.stderr )
+
+    def run( self ):                        # override superclass run
+        lut = self.get_lut()
+        if lut is None:
+            print( 'somgroup: cannot build lookup table', file=sys.stderr )
+            return
+
+        # one label band in
+        labels = self.source
+        if labels.ndim == 3:
+            labels = labels[:,:,:1]
+
+        if labels.max() >= len( lut ):
+            print( 'somgroup: labels exceed the', len( lut ),
+                   'neurons of', self.params.weightfile, file=sys.stderr )
+            return
+
+        self.sink = lut[labels]
+
+        self.band_tags = []
+        self.band_tags.append( 'som groups' )
+
+    ####################################################################
+    # gui section
+    ####################################################################
+
+    def read_params_from_panel( self ):  # scan panel parameters
+        self.params.weightfile = self.t_weightfile.GetValue()
+        self.params.nclasses = int( self.t_nclasses.GetValue() )
+        self.params.method = self.t_method.GetValue().strip()
+
+    def write_params_to_panel( self ):   # write parameters to panel
+        self.t_weightfile.SetValue( self.params.weightfile )
+        self.t_nclasses.SetValue( str( self.params.nclasses ) )
+        self.t_method.SetValue( self.params.method )
+
+    # initialize graphics
+    def init_panel( self, benchtop ):
+        op_panel.init_panel( self, benchtop ) # start with basics
+
+        v_sizer = wx.BoxSizer( wx.VERTICAL )
+        h_sizer = wx.BoxSizer( wx.HORIZONTAL )
+
+        v_sizer.Add( (1,30) ) # go down a bit on panel
+
+        l_prompt = wx.StaticText( self.p_client, -1,
+                                  ' enter number of groups: ' )
+        h_sizer.Add( l_prompt, 0, wx.TOP, 5 )
+
+        self.t_nclasses = wx.TextCtrl( self.p_client, -1, '',
+                                       size=(35,25), style=wx.ALIGN_RIGHT )
+        self.t_nclasses.SetToolTip( 'Neuron classes are merged into this many groups. The label image must come from the weight file below.' )
+
+        h_sizer.Add( self.t_nclasses, 0, wx.TOP )
+        v_sizer.Add( h_sizer )
+        v_sizer.Add( (1,20) )
+
+        h_sizer = wx.BoxSizer( wx.HORIZONTAL )
+        l_prompt = wx.StaticText( self.p_client, -1, ' enter linkage method: ' )
+        h_sizer.Add( l_prompt, 0, wx.TOP, 5 )
+
+        self.t_method = wx.TextCtrl( self.p_client, -1, '', size=(90,25) )
+        self.t_method.SetToolTip( 'ward, average, complete or single' )
+
+        h_sizer.Add( self.t_method, 0, wx.TOP )
+        v_sizer.Add( h_sizer )
+        v_sizer.Add( (1,46) )
+
+        h_sizer = wx.BoxSizer( wx.HORIZONTAL )
+        prompt = wx.StaticText( self.p_client, -1, 'enter weight filename:' )
+        h_sizer.Add( prompt, 0, wx.TOP, 5 )
+
+        self.t_weightfile = wx.TextCtrl( self.p_client, -1 )
+        self.t_weightfile.SetToolTip( ' enter filename to read weights from (.labels or .npz)' )
+        h_sizer.Add( self.t_weightfile, 1, wx.EXPAND )
+
+        v_sizer.Add( h_sizer, 1, wx.EXPAND )
+        self.p_client.SetSizer( v_sizer )
+        self.write_params_to_panel()
+
+    ############################################################
+    # command line options
+    ############################################################
+
+    def usage( self ):
+        print( 'usage: somgroup.py', file=sys.stderr )
+        print( '       -h, --help', file=sys.stderr )
+        print( '       -f weights, --file=weights', file=sys.stderr )
+        print( '       -n num_groups, --nclasses=num_groups', file=sys.stderr )
+        print( '       -m method, --method=method   ward, average, complete, single',
+               file=sys.stderr )
+        print( '       -l lutfile, --lut=lutfile   write label to group table',
+               file=sys.stderr )
+        print( '       -p param_file, --params=param_file', file=sys.stderr )
+        print( '       input is a label image on stdin, output is stdout',
+               file=sys.stderr )
+
+    def set_params( self, argv ):
+        params = None
+
+        try:
+            opts, args = getopt.getopt( argv,
+                                        'hp:f:n:m:l:',
+                                        ['help','params=','file=','nclasses=',
+                                         'method=','lut='] )
+        except getopt.GetoptError:
+            self.usage()
+            sys.exit(2)
+
+        for opt, arg in opts:
+            if opt in ( '-h', '--help' ):
+                self.usage()
+                sys.exit(0)
+            elif opt in ( '-f', '--file' ):
+                self.params.weightfile = arg
+            elif opt in ( '-n', '--nclasses' ):
+                self.params.nclasses = int(arg)
+            elif opt in ( '-m', '--method' ):
+                self.params.method = arg
+            elif opt in ( '-l', '--lut' ):
+                self.params.lutfile = arg
+            elif opt in ('-p', '--params'):
+                params = arg
+
+        if params != None:
+            ok = self.read_params_from_file( params )
+            if not ok:
+                print( "somgroup.py: cannot read parameter file", file=sys.stderr)
+                sys.exit(2)
+
+####################################################################
+# command line user entry point
+####################################################################
+
+if __name__ == '__main__':
+    from poli_stream import read_stream, write_stream
+
+    oper = instantiate()
+    oper.set_params( sys.argv[1:] )
+
+    read_stream( oper )           # receive from upstream
+
+    oper.run()
+    write_stream( oper )          # send downstream
@@ -281,10 +281,12 @@ class source( op_panel ):
 ####################################################################
 
 if __name__ == '__main__':             
+    from poli_stream import write_stream
+
     oper = instantiate()                  # source point for pipe
     oper.set_params( sys.argv[1:] )
     oper.run()            
-    oper.sink.dump( sys.stdout.buffer )   # send downstream as pickle file
+    write_stream( oper )                  # send downstream as poli stream
 
 
     # TODO: try using pickle dump for all of operator values
@@ -27,6 +27,7 @@
 
 # create a netCDF wrf data source
 # XLAT and XLONG are automatically read into nav buffers
+# a time range, eg. T2:0-23, produces a (time,y,x,band) cube
 # NOTE: 4-D data not implemented, eg. T
 
 wrf_source_copyright = 'wrf_source.py Copyright (c) 2016-2022 Scott L. Williams, released under GNU GPL V3.0'
@@ -35,6 +36,7 @@ import wx
 import os
 import sys
 import getopt
+import hashlib
 
 import numpy as np
 from osgeo import gdal
@@ -51,6 +53,9 @@ def instantiate():
 def get_name(): 
     return 'wrf_source'
 
+# navigation grids held for the session, keyed by domain geometry
+nav_cache = {}
+
 # clean up text after drop in filepath textctrl
 class FileDrop( wx.FileDropTarget ):
     def __init__( self, window, op_panel ):
@@ -78,6 +83,9 @@ class wrf_source_parameters():
                                 # FIXME: hidden feature as it does not have a
                                 # gui or command line parameter. consider making
                                 # just a constant band, with negative values
+
+        self.nav_cachedir = ''  # directory for memory-mappable nav grids,
+                                # empty to keep the cache in memory only
                                 
 class wrf_source( op_panel ):          # image source operator
 
@@ -85,12 +93,33 @@ class wrf_source( op_panel ):          # image source operator
         op_panel.__init__( self, name )
         self.op_id = 'wrf_source version 0.0'
         self.params = wrf_source_parameters()
+        self.time_steps = {}           # Times lookups by (file, mtime)
         gdal.PushErrorHandler( 'CPLQuietErrorHandler' ) # suppress warning
         
+    # time indices are a single hour, eg. T2:6, or an inclusive
+    # range of hours, eg. T2:0-23. None for negative hours or a
+    # reversed range
+    def str2times( self, s ):
+        try:
+            if '-' in s:
+                first, last = s.split('-')
+                first = int( first )
+                last = int( last )
+            else:
+                first = last = int( s )
+        except ValueError:
+            return None
+
+        if first < 0 or last < first:
+            return None
+
+        return list( range( first, last+1 ) )
+
     def str2list( self, s ): 
 
         self.bufs = []
-        self.tbands = []               # time bands
+        self.tbands = []               # time bands, list of hours per buffer
+        self.tstrs = []                # time strings as given, for tags
         self.lbands = []               # level bands
         items = s.split(',')          
 
@@ -105,105 +134,242 @@ class wrf_source( op_panel ):          # image source operator
         for x in u:
             items = x.split(':')
             self.bufs.append( items[0] )
-            self.tbands.append( int(items[1]) )
+            self.tstrs.append( items[1] )
+
+            times = self.str2times( items[1] )
+            if times == None:
+                print( 'bad time index:', items[1], file=sys.stderr )
+                return False
+            self.tbands.append( times )
             try:
                 self.lbands.append( int(items[2]) )
             except:
                 self.lbands.append( 0 )
+
+        # ranges stack into a time cube; they must all cover the same
+        # number of hours. single hours are used for every frame
+        lengths = set( [ len(t) for t in self.tbands if len(t) > 1 ] )
+        if len( lengths ) > 1:
+            print( 'wrf_source: time ranges are not the same length',
+                   file=sys.stderr )
+            return False
+
+        if len( lengths ) == 1:
+            self.ntimes = lengths.pop()
+        else:
+            self.ntimes = 1
+
+        return True
       
-    def run( self ):                   # override superclass run
+    # open a wrf variable subdataset once per run
+    def open_variable( self, name, datasets ):
+        if name in datasets:
+            return datasets[name]
 
-        # FIXME: gracefully return if error encountered
-        #        and log to messages
+        bufstr = 'NETCDF:"' + self.params.filepath + '":' + name
+        try:
+            ds = gdal.Open( bufstr )
+        except:
+            ds = None
 
-        # FIXME: implement URL source
+        # does gdal return ds == None?
+        if ds == None:
+            print( 'cannot get WRF dataset: '+ name, file=sys.stderr )
+            return None
 
-        self.source_name = self.params.filepath  # set op_panel's source name
-        self.str2list( self.params.bandstr )
+        datasets[name] = ds
+        return ds
+
+    # get number of time steps; the Times dimension does not
+    # change for a file so keep it between runs
+    def get_time_steps( self ):
+        try:
+            key = ( self.params.filepath,
+                    os.path.getmtime( self.params.filepath ) )
+        except OSError:
+            key = None                 # let gdal report the problem
+
+        if key != None and key in self.time_steps:
+            return self.time_steps[key]
 
-        # get number of time steps
         bufstr = 'NETCDF:"' + self.params.filepath + '":Times'
         try:
             gdal.PushErrorHandler( 'CPLQuietErrorHandler' ) # suppress warnings
             ds = gdal.Open( bufstr )
         except:
-            print( 'cannot get dataset: Times', file=sys.stderr )
-            return
-        
+            ds = None
+
         # does gdal return ds == None?
         if ds == None:
             print( 'cannot get dataset: Times', file=sys.stderr )
+            return None
+
+        if key != None:
+            self.time_steps[key] = ds.RasterYSize
+
+        return ds.RasterYSize
+
+    def run( self ):                   # override superclass run
+
+        # FIXME: gracefully return if error encountered
+        #        and log to messages
+
+        # FIXME: implement URL source
+
+        self.source_name = self.params.filepath  # set op_panel's source name
+        if not self.str2list( self.params.bandstr ):
+            return
+
+        time_steps = self.get_time_steps()
+        if time_steps == None:
             return
 
-        time_steps = ds.RasterYSize
+        # grab data from wrf output into a (time,y,x,band) cube;
+        # with a single hour the cube collapses to the usual (y,x,band)
+        cube = None
+        ntimes = self.ntimes
+        nbands = self.numbufs
+        if self.params.tslice_band > -1.0:
+            nbands += 1
 
-        # grab data from wrf output
+        datasets = {}                  # one open dataset per variable
         self.band_tags = []
         for i in range(0,self.numbufs):
 
-            bufstr = 'NETCDF:"' + self.params.filepath + '":' + self.bufs[i]
-            try:
-                ds = gdal.Open( bufstr )
-            except:
-                print( 'cannot get WRF dataset:', self.bufs[i],
-                       file=sys.stderr )
-                return
-
-            # does gdal return ds == None?
+            ds = self.open_variable( self.bufs[i], datasets )
             if ds == None:
-                print( 'cannot get WRF dataset: '+ self.bufs[i],
-                       file=sys.stderr )
                 return
 
-
             # 4D arrays are represented as timesteps*3D arrays
             # because netcdf doesn't know how to handle
             # 4D arrays (x,y,z,t) where z represents height levels
             stride = ds.RasterCount/time_steps # will be 1 for 2D arrays
 
-            if self.tbands[i] < 0 or self.tbands[i] >= time_steps:
-                print( 'bad time index:', self.tbands[i], file=sys.stderr )
-                return
-
             if self.lbands[i] < 0 or self.lbands[i] >= stride:
                 print( 'bad height level index:', self.lbands[i], file=sys.stderr )
                 return
 
-            index = int( self.tbands[i]*stride + self.lbands[i] )
-            data = ds.ReadAsArray()[ index ]
-
             # include vertical level, if available
-            self.band_tags.append( self.bufs[i] + ':' + str(self.tbands[i]) )
+            self.band_tags.append( self.bufs[i] + ':' + self.tstrs[i] )
             #                                   ':' + str(self.lbands[i]) ) # no levels implemented
 
-            if i == 0:
-                # save to compare later
-                numy = data.shape[0]
-                numx = data.shape[1]
-                dtype = data.dtype 
+            for t, tband in enumerate( self.tbands[i] ):
 
-                if self.params.tslice_band > -1.0:
-                    self.sink = np.empty( (numy,numx,self.numbufs+1), dtype=dtype )
-                else:
-                    self.sink = np.empty( (numy,numx,self.numbufs), dtype=dtype )
-            else:
-                if numy != data.shape[0] or numx != data.shape[1]:
-                    print( 'data shapes do not match:', file=sys.stderr )
+                if tband < 0 or tband >= time_steps:
+                    print( 'bad time index:', tband, file=sys.stderr )
                     return
 
-                if dtype != data.dtype:
-                    print( 'data type do not match', self.bufs[0], self.bufs[i],
-                           file=sys.stderr )
-                    return
+                # decode only the requested band (gdal bands are 1-indexed)
+                index = int( tband*stride + self.lbands[i] )
+                data = ds.GetRasterBand( index+1 ).ReadAsArray()
+
+                if cube is None:
+                    # save to compare later
+                    numy = data.shape[0]
+                    numx = data.shape[1]
+                    dtype = data.dtype 
+
+                    cube = np.empty( (ntimes,numy,numx,nbands), dtype=dtype )
+                else:
+                    if numy != data.shape[0] or numx != data.shape[1]:
+                        print( 'data shapes do not match:', file=sys.stderr )
+                        return
+
+                    if dtype != data.dtype:
+                        print( 'data type do not match', self.bufs[0], self.bufs[i],
+                               file=sys.stderr )
+                        return
 
-            self.sink[:,:,i] = data
+                if len( self.tbands[i] ) == 1:
+                    cube[:,:,:,i] = data   # same hour in every frame
+                else:
+                    cube[t,:,:,i] = data
 
         if self.params.tslice_band > -1.0:
             # populate the buffer with a constant >= 0
-            self.sink[:,:,self.numbufs] = self.params.tslice_band
+            cube[:,:,:,self.numbufs] = self.params.tslice_band
             
             self.band_tags.append( 'time slice') # could be any constant
+
+        if ntimes == 1:
+            self.sink = cube[0]
+        else:
+            self.sink = cube
+
+        self.read_nav()         # automatically read nav data
         
+    # key a domain by grid shape and a hash of its corner coordinates;
+    # reads eight single pixels instead of the full grids
+    def nav_key( self, lat_ds, lon_ds ):
+        numx = lat_ds.RasterXSize
+        numy = lat_ds.RasterYSize
+
+        corners = []
+        for ds in ( lat_ds, lon_ds ):
+            band = ds.GetRasterBand( 1 )
+            for x, y in ( (0,0), (numx-1,0), (0,numy-1), (numx-1,numy-1) ):
+                corners.append( band.ReadAsArray( x, y, 1, 1 )[0,0] )
+
+        corners = np.array( corners, dtype=np.float64 )
+        digest = hashlib.sha1( corners.tobytes() ).hexdigest()[:16]
+
+        return '%dx%d_%s' % ( numy, numx, digest )
+
+    # read XLAT and XLONG into nav buffers; the grid does not change
+    # for a domain so it is decoded once and cached
+    def read_nav( self ):
+        datasets = {}
+        lat_ds = self.open_variable( 'XLAT', datasets )
+        lon_ds = self.open_variable( 'XLONG', datasets )
+        if lat_ds == None or lon_ds == None:
+            return
+
+        key = self.nav_key( lat_ds, lon_ds )
+
+        path = None
+        if self.params.nav_cachedir != '':
+            path = os.path.join( self.params.nav_cachedir,
+                                 'wrf_nav_' + key + '.npy' )
+
+        if key in nav_cache:
+            nav_data = nav_cache[key]
+
+        elif path != None and os.path.isfile( path ):
+            nav_data = np.load( path, mmap_mode='r' )
+            nav_cache[key] = nav_data
+
+        else:
+            # XLAT and XLONG have one buffer per time step in original
+            # WRF output or just one in filtered output; take the first
+            lats = lat_ds.GetRasterBand( 1 ).ReadAsArray()
+            lons = lon_ds.GetRasterBand( 1 ).ReadAsArray()
+
+            numy, numx = lats.shape
+            nav_data = np.empty( (numy,numx,2), dtype=lats.dtype )
+            nav_data[:,:,0] = lats      # load latitudes
+            nav_data[:,:,1] = lons      # load longitudes
+
+            nav_data.flags.writeable = False  # shared between runs
+            nav_cache[key] = nav_data
+
+            if path != None:
+                self.save_nav( nav_data, path )
+
+        self.nav_data = nav_data
+        self.nav_tags = ['lat', 'lon']
+
+    # write nav grid next to others; rename so readers never
+    # see a partial file
+    def save_nav( self, nav_data, path ):
+        temp = path + '.tmp'
+        try:
+            tfile = open( temp, 'wb' )
+            np.save( tfile, nav_data )
+            tfile.close()
+            os.replace( temp, path )
+        except OSError as e:
+            print( 'wrf_source: cannot cache nav data:', e, file=sys.stderr )
+
     ####################################################################
     # gui section
     ####################################################################
@@ -248,42 +414,21 @@ class wrf_source( op_panel ):          # image source operator
         if type( self.sink ) is not np.ndarray:
             return
 
-        # automatically read nav data
-        bufstr = 'NETCDF:"' + self.params.filepath + '":XLAT'
-        try:
-            ds = gdal.Open( bufstr )
-        except:
-            print( 'cannot get dataset: XLAT', file=sys.stderr )
-            return
-
-        # determine XLAT has multiple buffers (orginal WRF output)
-        # or if just one (filtered WRF output)
-        data = ds.ReadAsArray()
-        if len( data.shape ) == 3:
-            data = data[0]
-            
-        numy, numx = data.shape
-        dtype = data.dtype
-
-        # we have shape, dtype make nav data buffer
-        self.nav_data = np.empty( (numy,numx,2), dtype=dtype )
-        self.nav_data[:,:,0] = data # load latitudes
-
-        bufstr = 'NETCDF:"' + self.params.filepath + '":XLONG'
-        try:
-            ds = gdal.Open( bufstr )
-        except:
-            print( 'cannot get dataset: XLONG', file=sys.stderr )
-            return
-        
-        # determine XLONG has multiple buffers (orginal WRF output)
-        # or if just one (filtered WRF output). should be same as XLAT
-        data = ds.ReadAsArray()
-        if len( data.shape ) == 3:
-            data = data[0]
- 
-        self.nav_data[:,:,1] = data # load longitudes
-        self.nav_tags = ['lat', 'lon']
+        # the display works on (y,x,band) buffers; lay the hours of a
+        # time cube out as consecutive sets of bands
+        if self.sink.ndim == 4:
+            ntimes,numy,numx,nbands = self.sink.shape
+            tags = []
+            for t in range( ntimes ):
+                for i in range( self.numbufs ):
+                    hours = self.tbands[i]
+                    hour = hours[ min( t, len(hours)-1 ) ]
+                    tags.append( self.bufs[i] + ':' + str( hour ) )
+                if nbands > self.numbufs:
+                    tags.append( 'time slice' )
+
+            self.sink = np.moveaxis( self.sink, 0, 2 ).reshape( (numy,numx,ntimes*nbands) )
+            self.band_tags = tags
 
         self.center = True  # center image
 
@@ -306,7 +451,7 @@ class wrf_source( op_panel ):          # image source operator
         v_sizer.Add( prompt ) 
 
         self.t_bandstr = wx.TextCtrl( self.p_client, -1 )
-        self.t_bandstr.SetToolTip( 'comma delimited string for buffers; semi-colon delimited for time and level indices. eg POTEVP:20 gives 20th time PET band eg. P:4:20 gives pressure at 4th time-step and 20th height level. REMEMBER:0th indexed' )
+        self.t_bandstr.SetToolTip( 'comma delimited string for buffers; semi-colon delimited for time and level indices. eg POTEVP:20 gives 20th time PET band eg. P:4:20 gives pressure at 4th time-step and 20th height level. eg. T2:0-23 stacks hours 0 to 23 into a time cube. REMEMBER:0th indexed' )
         self.t_bandstr.Bind( wx.EVT_KEY_DOWN, self.on_file_key) 
         v_sizer.Add( self.t_bandstr, 1, wx.EXPAND )
 
@@ -369,8 +514,12 @@ class wrf_source( op_panel ):          # image source operator
         print( '       -h, --help', file=sys.stderr )
         print( '       -b bands, --bands=bands w/bands as string',
                file=sys.stderr )
+        print( '          eg. T2:6,Q2:6 or T2:0-23,Q2:0-23 for a time cube',
+               file=sys.stderr )
         print( '       -f wrf_file, --file=wrf_file',
                file=sys.stderr )
+        print( '       -n nav_dir, --navcache=nav_dir',
+               file=sys.stderr )
         print( '       -p paramfile, --params=paramfile', file=sys.stderr )
         print( '       param file overrides line arguments', file=sys.stderr )
 
@@ -382,8 +531,9 @@ class wrf_source( op_panel ):          # image source operator
 
         try:                                
             opts, args = getopt.getopt( argv,
-                                        'hb:f:p:', 
-                                        ['help','bands=', 'file=', 'params='])
+                                        'hb:f:n:p:', 
+                                        ['help','bands=', 'file=',
+                                         'navcache=', 'params='])
         except getopt.GetoptError:           
             self.usage()              
             sys.exit(2)  
@@ -396,6 +546,8 @@ class wrf_source( op_panel ):          # image source operator
                 self.params.filepath = arg    
             elif opt in ( '-b', '--bands' ):
                 self.params.bandstr = arg
+            elif opt in ( '-n', '--navcache' ):
+                self.params.nav_cachedir = arg
             elif opt in ( '-p', '--params' ):
                 params = arg  
 
@@ -418,13 +570,20 @@ class wrf_source( op_panel ):          # image source operator
                        file=sys.stderr )
                 sys.exit( 2 )
 
+        # check the band string now rather than in run
+        if not self.str2list( self.params.bandstr ):
+            self.usage()
+            sys.exit( 2 )
+
 ####################################################################
 # command line user entry point 
 ####################################################################
 
 if __name__ == '__main__':      
+    from poli_stream import write_stream
+
     oper = instantiate()                  # source point for pipe
     oper.set_params( sys.argv[1:] )
     oper.run()            
-    oper.sink.dump( sys.stdout.buffer )   # send downstream    
+    write_stream( oper )                  # send downstream    
 